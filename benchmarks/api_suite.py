@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the add-on API with machine-readable results
+
+Drives the FastAPI app in-process through httpx's ASGI transport, every
+scenario in a fresh interpreter with its own temporary DATA_DIR:
+
+    post      POST throughput, single events and batches
+    get       GET p50/p99 latency of today's feed at 10/100/1000 stored
+              events: re-encoded, served from the response cache,
+              filtered and as a since_seq delta; and of /api/stats
+    mixed     concurrent clients reading and writing at the same time
+    search    /api/search p50/p99 latency over 7 days of 1000 events:
+              a rare word, a common word, a prefix and two words
+    startup   import and startup time with 1000 events, loaded from the
+              snapshot and replayed from the write-ahead log
+
+Latencies include the ASGI client, but no network. Every scenario runs
+--repeat times and each metric is the median of the runs. Results are
+written as flat JSON metrics ("..._per_s": higher is better, "..._ms":
+lower is better) and can be compared with an earlier run:
+
+    python benchmarks/api_suite.py [--scenarios post,get] [--output run.json]
+    python benchmarks/api_suite.py --compare baseline.json
+
+With --compare the exit code is 1 if a metric got worse by more than
+--threshold percent (--tail-threshold for p99 latencies, which are a lot
+noisier at sub-millisecond scale). Compare runs from the same machine.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+ADDON_DIR = ROOT / "daily_activity_feed"
+
+SCENARIOS = ("post", "get", "mixed", "search", "startup")
+STORED_EVENTS = (10, 100, 1000)
+# Untimed requests before each latency case
+WARMUP = 20
+MAX_EVENTS = 1000
+TYPES = ("doorbell", "door", "motion", "energy")
+PRIORITIES = ("low", "normal", "high")
+# Sealed days written before the search scenario starts, on top of today
+HISTORY_DAYS = 6
+CARRIERS = ("DHL", "UPS", "FedEx", "DPD", "Hermes", "GLS", "Amazon", "PostNL")
+WORDS = (
+    "front", "back", "garage", "garden", "kitchen", "hallway", "door", "window", "opened", "closed",
+    "motion", "detected", "package", "delivered", "parcel", "courier", "doorbell", "rang", "camera",
+    "person", "vehicle", "driveway", "washer", "finished", "dryer", "energy", "consumption", "high",
+)
+
+
+def make_event(n: int) -> dict:
+    return {
+        "type": TYPES[n % len(TYPES)],
+        "title": f"Event {n}",
+        "text": "Benchmark event",
+        "priority": PRIORITIES[n % len(PRIORITIES)],
+    }
+
+
+def make_search_event(rng: random.Random, n: int) -> dict:
+    """An event with a few words drawn from a fixed vocabulary"""
+    words = rng.sample(WORDS, 4)
+    return {
+        "type": TYPES[n % len(TYPES)],
+        "title": f"{rng.choice(CARRIERS)} {words[0]}",
+        "text": " ".join(words[1:]),
+        "priority": PRIORITIES[n % len(PRIORITIES)],
+    }
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50 and p99 of latencies in seconds, in milliseconds"""
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": round(cuts[49] * 1000, 3), "p99_ms": round(cuts[98] * 1000, 3)}
+
+
+async def timed(samples: List[float], request: Awaitable) -> None:
+    """Await a request, record its latency and fail on an error status"""
+    start = time.perf_counter()
+    response = await request
+    samples.append(time.perf_counter() - start)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.url} answered {response.status_code}")
+
+
+# Workers: each runs in its own interpreter and prints its metrics as JSON
+
+
+def import_app():
+    """Import the add-on for the DATA_DIR in the environment"""
+    sys.path.insert(0, str(ADDON_DIR))
+    import app as addon
+
+    # Keep the per-event log lines out of the measurement and the report
+    addon.logger.setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return addon
+
+
+async def with_client(addon, run: Callable) -> dict:
+    """Start the add-on, run a scenario against it and shut it down"""
+    import httpx
+
+    await addon.startup_event()
+    transport = httpx.ASGITransport(app=addon.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://addon", timeout=60) as client:
+        metrics = await run(client)
+    await addon.shutdown_event()
+    return metrics
+
+
+async def fill(client, count: int, start: int = 0) -> None:
+    """Add count events in batches of 100"""
+    for offset in range(start, start + count, 100):
+        batch = [make_event(n) for n in range(offset, min(offset + 100, start + count))]
+        (await client.post("/api/events/batch", json=batch)).raise_for_status()
+
+
+async def worker_post(args) -> dict:
+    addon = import_app()
+
+    async def run(client) -> dict:
+        await fill(client, 100)
+        metrics = {}
+
+        start = time.perf_counter()
+        for n in range(args.requests):
+            (await client.post("/api/event", json=make_event(n))).raise_for_status()
+        metrics["post.single.events_per_s"] = round(args.requests / (time.perf_counter() - start))
+
+        batches = max(args.requests // 50, 1)
+        start = time.perf_counter()
+        for b in range(batches):
+            batch = [make_event(b * 50 + n) for n in range(50)]
+            (await client.post("/api/events/batch", json=batch)).raise_for_status()
+        metrics["post.batch50.events_per_s"] = round(batches * 50 / (time.perf_counter() - start))
+
+        # Include the final commit so queued writes are not left out
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(client.post("/api/event", json=make_event(n)) for n in range(args.requests))
+        )
+        await addon.feeds[addon.DEFAULT_FEED].store.commit()
+        metrics["post.concurrent.events_per_s"] = round(args.requests / (time.perf_counter() - start))
+        return metrics
+
+    return await with_client(addon, run)
+
+
+async def worker_get(args) -> dict:
+    addon = import_app()
+
+    async def run(client) -> dict:
+        metrics = {}
+        stored = 0
+        for size in STORED_EVENTS:
+            await fill(client, size - stored, stored)
+            stored = size
+            since_seq = max(addon.feeds[addon.DEFAULT_FEED].store.last_seq - 5, 0)
+            cases = {
+                "cold": ("/api/events/today", {}),
+                "cached": ("/api/events/today", {}),
+                "filtered": ("/api/events/today", {"type": "doorbell", "priority": "high", "limit": "20"}),
+                "since_seq": ("/api/events", {"since_seq": str(since_seq)}),
+                "stats": ("/api/stats", {}),
+            }
+            for name, (path, params) in cases.items():
+                for _ in range(WARMUP):
+                    await client.get(path, params=params)
+                samples: List[float] = []
+                for _ in range(args.requests):
+                    if name in ("cold", "stats"):
+                        # Make every request build and encode the body again
+                        addon.feeds[addon.DEFAULT_FEED].response_cache.clear()
+                    await timed(samples, client.get(path, params=params))
+                for key, value in percentiles(samples).items():
+                    metrics[f"get.{name}.{size}.{key}"] = value
+        return metrics
+
+    return await with_client(addon, run)
+
+
+async def worker_mixed(args) -> dict:
+    addon = import_app()
+
+    async def run(client) -> dict:
+        await fill(client, 500)
+        reads: List[float] = []
+        writes: List[float] = []
+        ops_per_client = max(args.requests // args.clients, 1)
+
+        async def client_loop(seed: int) -> None:
+            rng = random.Random(seed)
+            for n in range(ops_per_client):
+                roll = rng.random()
+                if roll < args.write_ratio:
+                    await timed(writes, client.post("/api/event", json=make_event(n)))
+                elif roll < (1 + args.write_ratio) / 2:
+                    await timed(reads, client.get("/api/events/today", params={"limit": "50"}))
+                else:
+                    since_seq = max(addon.feeds[addon.DEFAULT_FEED].store.last_seq - rng.randint(1, 20), 0)
+                    await timed(reads, client.get("/api/events", params={"since_seq": str(since_seq)}))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(seed) for seed in range(args.clients)))
+        elapsed = time.perf_counter() - start
+
+        metrics = {"mixed.ops_per_s": round(ops_per_client * args.clients / elapsed)}
+        for name, samples in (("read", reads), ("write", writes)):
+            if len(samples) >= 2:
+                for key, value in percentiles(samples).items():
+                    metrics[f"mixed.{name}.{key}"] = value
+        return metrics
+
+    return await with_client(addon, run)
+
+
+def write_history(data_dir: Path, rng: random.Random) -> None:
+    """Write full sealed days before the add-on starts, as earlier midnights would have"""
+    sys.path.insert(0, str(ADDON_DIR))
+    import codec
+
+    days_dir = data_dir / "days"
+    days_dir.mkdir(parents=True, exist_ok=True)
+    seq = 1
+    for back in range(HISTORY_DAYS, 0, -1):
+        day = (datetime.now().date() - timedelta(days=back)).isoformat()
+        events = []
+        for n in range(MAX_EVENTS):
+            event = make_search_event(rng, n)
+            events.append({**event, "timestamp": "12:00:00", "date": day, "seq": seq})
+            seq += 1
+        events.reverse()
+        (days_dir / f"{day}.json").write_bytes(codec.dumps({"date": day, "events": events}))
+    # Without a dated snapshot the store wouldn't know that the newest day is yesterday
+    snapshot = {"date": datetime.now().date().isoformat(), "today": [], "next_seq": seq}
+    (data_dir / "events.json").write_bytes(codec.dumps(snapshot))
+
+
+async def worker_search(args) -> dict:
+    rng = random.Random(0)
+    write_history(Path(os.environ["DATA_DIR"]), rng)
+    addon = import_app()
+
+    async def run(client) -> dict:
+        for offset in range(0, MAX_EVENTS, 100):
+            batch = [make_search_event(rng, n) for n in range(offset, offset + 100)]
+            (await client.post("/api/events/batch", json=batch)).raise_for_status()
+        metrics = {"search.indexed_events": len(addon.feeds[addon.DEFAULT_FEED].store._index)}
+        cases = {
+            "rare": {"q": "dhl kitchen"},
+            "common": {"q": "door"},
+            "prefix": {"q": "deliv"},
+            "filtered": {"q": "package", "type": "doorbell", "sort": "newest"},
+        }
+        for name, params in cases.items():
+            for _ in range(WARMUP):
+                await client.get("/api/search", params=params)
+            samples: List[float] = []
+            for _ in range(args.requests):
+                # Every request searches, instead of being served from the response cache
+                addon.feeds[addon.DEFAULT_FEED].response_cache.clear()
+                await timed(samples, client.get("/api/search", params=params))
+            for key, value in percentiles(samples).items():
+                metrics[f"search.{name}.{key}"] = value
+        return metrics
+
+    return await with_client(addon, run)
+
+
+async def worker_fill(args) -> dict:
+    """Prepare a data directory for the startup scenario"""
+    addon = import_app()
+    await addon.startup_event()
+    import httpx
+
+    transport = httpx.ASGITransport(app=addon.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://addon") as client:
+        await fill(client, args.requests)
+    await addon.feeds[addon.DEFAULT_FEED].store.commit()
+    if not args.replay:
+        # A clean shutdown folds the log into the snapshot
+        await addon.shutdown_event()
+    # Otherwise exit like a crash: the events are only in the log
+    return {}
+
+
+async def worker_startup(args) -> dict:
+    start = time.perf_counter()
+    addon = import_app()
+    imported = time.perf_counter()
+    await addon.startup_event()
+    started = time.perf_counter()
+    loaded = addon.feeds[addon.DEFAULT_FEED].store.count("today")
+    if loaded != args.requests:
+        raise RuntimeError(f"Expected {args.requests} events after startup, found {loaded}")
+    await addon.shutdown_event()
+    name = "replay" if args.replay else "snapshot"
+    return {
+        f"startup.{name}.import_ms": round((imported - start) * 1000, 3),
+        f"startup.{name}.load_ms": round((started - imported) * 1000, 3),
+    }
+
+
+WORKERS = {
+    "post": worker_post,
+    "get": worker_get,
+    "mixed": worker_mixed,
+    "search": worker_search,
+    "fill": worker_fill,
+    "startup": worker_startup,
+}
+
+
+# Driver: runs the workers and collects their output
+
+
+def run_worker(name: str, data_dir: str, args, extra: List[str] = ()) -> dict:
+    """Run one worker in a fresh interpreter and return its metrics"""
+    env = {
+        **os.environ,
+        "DATA_DIR": data_dir,
+        "MAX_EVENTS": str(MAX_EVENTS),
+        "DURABILITY": args.durability,
+    }
+    command = [sys.executable, __file__, "--worker", name, *extra]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"{name} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_once(scenario: str, args) -> dict:
+    """Run a scenario against fresh temporary data directories"""
+    metrics = {}
+    variants = [("snapshot", []), ("replay", ["--replay"])] if scenario == "startup" else [(None, [])]
+    for _, flags in variants:
+        data_dir = tempfile.mkdtemp(prefix="daily-activity-feed-bench-")
+        try:
+            if scenario == "startup":
+                run_worker("fill", data_dir, args, ["--requests", str(MAX_EVENTS), *flags])
+                extra = ["--requests", str(MAX_EVENTS), *flags]
+            else:
+                extra = [
+                    "--requests", str(args.requests),
+                    "--clients", str(args.clients),
+                    "--write-ratio", str(args.write_ratio),
+                ]
+            metrics.update(run_worker(scenario, data_dir, args, extra))
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return metrics
+
+
+def run_scenario(scenario: str, args) -> dict:
+    """Run a scenario --repeat times and return the median of every metric"""
+    runs = [run_once(scenario, args) for _ in range(args.repeat)]
+    return {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(baseline: dict, current: dict, threshold: float, tail_threshold: float) -> bool:
+    """Print the change of every metric; False if one regressed beyond its threshold percent"""
+    ok = True
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, value in current.items():
+        old = baseline.get(name)
+        if not old:
+            print(f"{name:<40} {'-':>12} {value:>12} {'':>9}")
+            continue
+        change = (value - old) / old * 100
+        worse = -change if name.endswith("_per_s") else change
+        flag = ""
+        if worse > (tail_threshold if name.endswith("p99_ms") else threshold):
+            flag, ok = "  REGRESSION", False
+        print(f"{name:<40} {old:>12} {value:>12} {change:>+8.1f}%{flag}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per case")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients in the mixed scenario")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of writes in the mixed scenario")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the median is reported")
+    parser.add_argument("--durability", default="fsync", choices=("fsync", "flush"))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=20.0, help="regression threshold in percent")
+    parser.add_argument("--tail-threshold", type=float, default=50.0, help="regression threshold for p99 latencies")
+    parser.add_argument("--worker", choices=WORKERS, help=argparse.SUPPRESS)
+    parser.add_argument("--replay", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(WORKERS[args.worker](args))))
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    metrics = {}
+    for scenario in scenarios:
+        print(f"Running {scenario}...", file=sys.stderr)
+        metrics.update(run_scenario(scenario, args))
+
+    results = {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "clients": args.clients,
+            "write_ratio": args.write_ratio,
+            "repeat": args.repeat,
+            "durability": args.durability,
+        },
+        "metrics": metrics,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        sys.exit(0 if compare(baseline["metrics"], metrics, args.threshold, args.tail_threshold) else 1)
+    if not args.output:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Fire hundreds of parallel POSTs at the add-on and check none are lost
+
+By default the add-on runs in-process against a temporary data directory:
+every event is posted at once (single events, batches and sync=true
+writes mixed), today's feed is read back, and the store is reopened
+from disk to check the same events survived a restart.
+
+With --url the requests go to a running add-on instead. Its
+max_events_per_day must be at least --requests, and the disk check is
+skipped.
+
+    python benchmarks/concurrent_posts.py [--requests N] [--url URL]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+ADDON_DIR = Path(__file__).resolve().parent.parent / "daily_activity_feed"
+
+# Every BATCH_EVERY-th request posts a batch, every SYNC_EVERY-th one waits for the disk
+BATCH_EVERY = 10
+BATCH_SIZE = 3
+SYNC_EVERY = 7
+
+
+def build_requests(run_id: str, count: int) -> list:
+    """Return (path, body) pairs that add count events of type run_id in total"""
+    requests = []
+    n = 0
+    while n < count:
+        i = len(requests)
+        path = "/api/event"
+        if i % SYNC_EVERY == 0:
+            path += "?sync=true"
+        if i % BATCH_EVERY == 0 and count - n >= BATCH_SIZE:
+            body = [{"type": run_id, "title": str(n + j), "text": "stress"} for j in range(BATCH_SIZE)]
+            path = path.replace("/api/event", "/api/events/batch")
+            n += BATCH_SIZE
+        else:
+            body = {"type": run_id, "title": str(n), "text": "stress"}
+            n += 1
+        requests.append((path, body))
+    return requests
+
+
+async def fire(client: httpx.AsyncClient, run_id: str, count: int) -> float:
+    """Send all requests concurrently and return the elapsed seconds"""
+    requests = build_requests(run_id, count)
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(client.post(path, json=body) for path, body in requests))
+    elapsed = time.perf_counter() - start
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        sys.exit(f"{len(failed)} request(s) failed: {sorted(set(failed))}")
+    print(f"{len(requests)} requests ({count} events) in {elapsed:.2f}s - {count / elapsed:.0f} events/s")
+    return elapsed
+
+
+async def stored_titles(client: httpx.AsyncClient, run_id: str) -> list:
+    """Read back the titles of this run's events from today's feed"""
+    response = await client.get("/api/events/today", params={"type": run_id, "fields": "title"})
+    response.raise_for_status()
+    return [event["title"] for event in response.json()["events"]]
+
+
+def check(titles: list, count: int, where: str) -> bool:
+    """Report lost or duplicated events"""
+    lost = set(map(str, range(count))) - set(titles)
+    duplicated = len(titles) - len(set(titles))
+    print(f"{where}: {len(titles)} stored, {len(lost)} lost, {duplicated} duplicated")
+    return not lost and not duplicated
+
+
+async def run_remote(url: str, count: int) -> bool:
+    run_id = f"stress-{uuid.uuid4().hex[:8]}"
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        await fire(client, run_id, count)
+        return check(await stored_titles(client, run_id), count, "feed")
+
+
+async def run_local(count: int) -> bool:
+    data_dir = tempfile.mkdtemp(prefix="daily-activity-feed-")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["MAX_EVENTS"] = str(max(count, 100))
+    sys.path.insert(0, str(ADDON_DIR))
+    import app as addon  # noqa: E402
+
+    # Keep the per-event log lines out of the report
+    addon.logger.setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    run_id = "stress"
+    await addon.startup_event()
+    transport = httpx.ASGITransport(app=addon.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://addon", timeout=60) as client:
+        await fire(client, run_id, count)
+        ok = check(await stored_titles(client, run_id), count, "feed")
+    await addon.shutdown_event()
+
+    reopened = addon.EventStore(addon.DB_FILE, addon.MAX_EVENTS)
+    reopened.load()
+    _, events = reopened.query("today", types=[run_id])
+    ok = check([event.title for event in events], count, f"reloaded from {data_dir}") and ok
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="events to add (max 1000 in-process)")
+    parser.add_argument("--url", help="base URL of a running add-on, e.g. http://localhost:8099")
+    args = parser.parse_args()
+
+    if args.url:
+        ok = asyncio.run(run_remote(args.url, args.requests))
+    else:
+        ok = asyncio.run(run_local(min(args.requests, 1000)))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Insert cost of a full day at different MAX_EVENTS caps
+
+Compares the old list-based feed (slice to the cap, then insert at the
+front) with the add-on's DayEvents, whose indexes are deques used as
+ring buffers. Each case first fills the day to its cap, so every timed
+insert also evicts the oldest event.
+
+    python benchmarks/day_insert.py [--inserts N]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "daily_activity_feed"))
+
+from store import DayEvents, Record  # noqa: E402
+
+CAPS = (10, 100, 250, 500, 1000)
+
+
+def make_record(seq: int) -> Record:
+    return Record("motion", f"Event {seq}", "Benchmark event", priority="normal", seq=seq)
+
+
+def make_dict(seq: int) -> dict:
+    return make_record(seq).to_dict()
+
+
+def bench_list(cap: int, inserts: int) -> float:
+    """Seconds per insert with the previous slice-and-insert list"""
+    feed = [make_dict(seq) for seq in range(cap, 0, -1)]
+    events = [make_dict(seq) for seq in range(cap + 1, cap + inserts + 1)]
+
+    def run() -> None:
+        nonlocal feed
+        for event in events:
+            feed = feed[:cap - 1]
+            feed.insert(0, event)
+
+    return timeit.timeit(run, number=1) / inserts
+
+
+def bench_deque(cap: int, inserts: int) -> float:
+    """Seconds per insert with DayEvents (indexes included)"""
+    day = DayEvents(make_record(seq) for seq in range(1, cap + 1))
+    events = [make_record(seq) for seq in range(cap + 1, cap + inserts + 1)]
+
+    def run() -> None:
+        for event in events:
+            day.insert(event, cap)
+
+    return timeit.timeit(run, number=1) / inserts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inserts", type=int, default=50_000, help="timed inserts per case")
+    args = parser.parse_args()
+
+    print(f"{'cap':>6} {'list ns/insert':>16} {'deque ns/insert':>16}")
+    for cap in CAPS:
+        old = min(bench_list(cap, args.inserts) for _ in range(3))
+        new = min(bench_deque(cap, args.inserts) for _ in range(3))
+        print(f"{cap:>6} {old * 1e9:>16.0f} {new * 1e9:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
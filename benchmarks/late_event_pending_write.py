@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Check that late events never overwrite a day whose write is still queued
+
+Reproduces two ways a back-dated event used to reach an older day
+through a stale copy read from disk, so that the day file was then
+overwritten with only the late event:
+
+gap       events are added on day D0, the feed rolls over one day and
+          then over a 3-day gap before the writer flushes, D0 is read
+          and a late event dated D0 is added
+eviction  a late event is added to an older day, more days than the
+          cache holds are read before the writer flushes, and a second
+          late event is added to the first day
+
+Each case runs the store against a temporary data directory with a
+flush interval long enough that nothing is written in between, then
+reopens it from disk and checks every event of D0 survived.
+
+    python benchmarks/late_event_pending_write.py [--events N]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "daily_activity_feed"))
+
+from store import COLD_CACHE_SIZE, EventStore, Record  # noqa: E402
+
+D0 = date(2024, 3, 1)
+RETENTION_DAYS = 14
+# Nothing is flushed by the writer while a case runs
+FLUSH_INTERVAL = 3600.0
+
+
+def make_record(n: int, day_date: date = None) -> Record:
+    return Record(
+        "benchmark", f"Event {n}", "Late event check",
+        date=day_date.isoformat() if day_date else "",
+    )
+
+
+def open_store(data_dir: Path) -> EventStore:
+    store = EventStore(
+        data_dir / "events.json", max_events=1000,
+        retention_days=RETENTION_DAYS, flush_interval=FLUSH_INTERVAL,
+    )
+    store.load()
+    return store
+
+
+async def case_gap(data_dir: Path, count: int) -> int:
+    """Roll over a gap with D0's write still queued, then add a late event to D0"""
+    store = open_store(data_dir)
+    store.rollover(D0)
+    store.start_writer()
+    store.add_many([make_record(n) for n in range(count)])
+    store.rollover(D0 + timedelta(days=1))
+    store.rollover(D0 + timedelta(days=4))
+    seen = len((await store.load_partitions([D0]))[D0])
+    store.add(make_record(count, D0))
+    await store.close()
+    print(f"  D0 read back with {seen} of {count} events before the late one")
+    return count + 1
+
+
+async def case_eviction(data_dir: Path, count: int) -> int:
+    """Evict an older day from the cache while its write is queued, then add to it again"""
+    store = open_store(data_dir)
+    store.rollover(D0)
+    store.start_writer()
+    store.add_many([make_record(n) for n in range(count)])
+    for days in range(1, COLD_CACHE_SIZE + 4):
+        store.rollover(D0 + timedelta(days=days))
+        store.add(make_record(count + days))
+    await store.commit()
+
+    await store.load_partitions([D0])
+    store.add(make_record(count, D0))
+    await store.load_partitions(D0 + timedelta(days=days) for days in range(1, COLD_CACHE_SIZE + 2))
+    store.add(make_record(count + 1, D0))
+    await store.close()
+    return count + 2
+
+
+async def run(events: int) -> bool:
+    ok = True
+    for name, case in (("gap", case_gap), ("eviction", case_eviction)):
+        with tempfile.TemporaryDirectory() as tmp:
+            print(f"{name}:")
+            expected = await case(Path(tmp), events)
+            store = open_store(Path(tmp))
+            stored = len(store.partition(D0))
+            await store.close()
+        status = "ok" if stored == expected else "LOST EVENTS"
+        print(f"  D0 after restart: {stored} of {expected} events - {status}")
+        ok = ok and stored == expected
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=3, help="events added on D0 before the rollovers")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(0 if asyncio.run(run(args.events)) else 1)
+
+
+if __name__ == "__main__":
+    main()
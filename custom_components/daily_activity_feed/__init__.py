@@ -1,24 +1,39 @@
 """Daily Activity Feed Integration"""
 import asyncio
 import logging
+import uuid
 from datetime import datetime
+from pathlib import Path
 from typing import Any
 
 import aiohttp
-import async_timeout
 import voluptuous as vol
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
 from homeassistant.const import Platform
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers import config_validation as cv
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_track_time_change
+from homeassistant.helpers.typing import ConfigType
+from homeassistant.util import dt as dt_util
 
+from .api import DailyActivityFeedApiClient, DailyActivityFeedApiError
 from .const import (
     DOMAIN,
     CONF_ADDON_URL,
+    CONF_MAX_CONNECTIONS,
+    CONF_FEED,
+    CONF_SNAPSHOT_MAX_MB,
+    DATA_OUTBOXES,
+    DATA_SNAPSHOTS,
+    DEFAULT_FEED,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_RETENTION_DAYS,
+    DEFAULT_SNAPSHOT_MAX_MB,
+    PRIORITIES,
     SERVICE_ADD_EVENT,
+    SERVICE_GET_EVENTS,
     ATTR_TYPE,
     ATTR_TITLE,
     ATTR_TEXT,
@@ -26,12 +41,26 @@ from .const import (
     ATTR_CAMERA_ENTITY,
     ATTR_TIMESTAMP,
     ATTR_PRIORITY,
+    ATTR_DAY,
+    ATTR_LIMIT,
+    ATTR_CURSOR,
+    ATTR_FEED,
+    ATTR_CONFIG_ENTRY,
 )
+from .outbox import DailyActivityFeedOutbox, outbox_store
+from .snapshots import PendingSnapshotView, SnapshotManager, SnapshotView
 
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORMS = [Platform.SENSOR]
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+# Feed names as the add-on accepts them
+FEED_NAME = vol.All(cv.string, vol.Match(r"^[a-z0-9_-]{1,32}$"))
+# Becomes part of the add-on URL, so nothing but a day is let through
+DAY = vol.All(cv.string, vol.Match(r"^(today|yesterday|\d{4}-\d{2}-\d{2})$"))
+
 # Service Schema
 SERVICE_ADD_EVENT_SCHEMA = vol.Schema(
     {
@@ -42,15 +71,68 @@ SERVICE_ADD_EVENT_SCHEMA = vol.Schema(
         vol.Optional(ATTR_CAMERA_ENTITY): cv.entity_id,
         vol.Optional(ATTR_TIMESTAMP): cv.string,
         vol.Optional(ATTR_PRIORITY, default="normal"): vol.In(["low", "normal", "high"]),
+        vol.Optional(ATTR_FEED): FEED_NAME,
+        vol.Optional(ATTR_CONFIG_ENTRY): cv.string,
     }
 )
 
+SERVICE_GET_EVENTS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_DAY, default="today"): DAY,
+        vol.Optional(ATTR_TYPE): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional(ATTR_PRIORITY): vol.All(cv.ensure_list, [vol.In(PRIORITIES)]),
+        vol.Optional(ATTR_LIMIT): vol.All(vol.Coerce(int), vol.Range(min=1, max=1000)),
+        vol.Optional(ATTR_CURSOR): vol.Coerce(int),
+        vol.Optional(ATTR_FEED): FEED_NAME,
+        vol.Optional(ATTR_CONFIG_ENTRY): cv.string,
+    }
+)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up the snapshot store shared by all config entries."""
+    snapshots = SnapshotManager(hass, Path(hass.config.path(DOMAIN, "snapshots")))
+    await hass.async_add_executor_job(snapshots.load)
+    hass.data[DATA_SNAPSHOTS] = snapshots
+    hass.http.register_view(SnapshotView(snapshots))
+    hass.http.register_view(PendingSnapshotView(snapshots))
+    
+    # Drop expired snapshots shortly after midnight
+    async def _async_prune_daily(now: datetime) -> None:
+        await _async_prune_snapshots(hass)
+    
+    async_track_time_change(hass, _async_prune_daily, hour=0, minute=10, second=0)
+    
+    return True
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Daily Activity Feed from a config entry."""
+    config = {**entry.data, **entry.options}
+    
+    snapshots: SnapshotManager = hass.data[DATA_SNAPSHOTS]
+    snapshots.configure(
+        entry.entry_id, config.get(CONF_SNAPSHOT_MAX_MB, DEFAULT_SNAPSHOT_MAX_MB)
+    )
+    
+    client = DailyActivityFeedApiClient(
+        config[CONF_ADDON_URL],
+        config.get(CONF_MAX_CONNECTIONS, DEFAULT_MAX_CONNECTIONS),
+        config.get(CONF_FEED),
+    )
     hass.data.setdefault(DOMAIN, {})
-    hass.data[DOMAIN][entry.entry_id] = entry.data
-
+    hass.data[DOMAIN][entry.entry_id] = client
+    entry.async_create_background_task(
+        hass, _async_prune_snapshots(hass), f"{DOMAIN}_prune_snapshots"
+    )
+    
+    # Events are queued here and sent in the background
+    outbox = DailyActivityFeedOutbox(hass, entry, client)
+    await outbox.async_load()
+    hass.data.setdefault(DATA_OUTBOXES, {})
+    hass.data[DATA_OUTBOXES][entry.entry_id] = outbox
+    outbox.async_start()
+    
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     
     # Register update listener
@@ -63,6 +145,77 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     return True
 
 
+async def _async_prune_snapshots(hass: HomeAssistant) -> None:
+    """Ask the add-ons how long they keep events, then prune the snapshots.
+    
+    Events of any feed may show a snapshot, so they are kept as long as
+    the longest retention among an add-on's feeds.
+    """
+    snapshots: SnapshotManager = hass.data[DATA_SNAPSHOTS]
+    clients: dict[str, DailyActivityFeedApiClient] = hass.data.get(DOMAIN, {})
+    for entry_id, client in list(clients.items()):
+        try:
+            feeds = await client.async_get_feeds()
+        except (DailyActivityFeedApiError, aiohttp.ClientError, asyncio.TimeoutError) as err:
+            _LOGGER.debug("Could not get the add-on's retention: %s", err)
+            continue
+        if entry_id in clients:
+            snapshots.set_retention(
+                entry_id,
+                max(feed.get("retention_days", DEFAULT_RETENTION_DAYS) for feed in feeds),
+            )
+    await snapshots.async_prune()
+
+
+def _async_get_target(
+    hass: HomeAssistant, call: ServiceCall
+) -> tuple[ConfigEntry, DailyActivityFeedApiClient, str | None]:
+    """Return the entry, client and feed a service call is meant for.
+    
+    config_entry_id picks the entry. Otherwise the entry set up for the
+    requested feed (the default feed if none is named) is used, falling
+    back to the first entry, whose add-on then serves the named feed.
+    """
+    clients: dict[str, DailyActivityFeedApiClient] = hass.data.get(DOMAIN, {})
+    feed = call.data.get(ATTR_FEED)
+    
+    if ATTR_CONFIG_ENTRY in call.data:
+        entry_id = call.data[ATTR_CONFIG_ENTRY]
+        if entry_id not in clients:
+            raise HomeAssistantError(
+                f"Daily Activity Feed entry {entry_id} is not set up"
+            )
+    else:
+        wanted = feed or DEFAULT_FEED
+        entry_id = next(
+            (
+                other_id
+                for other_id, client in clients.items()
+                if (client.feed or DEFAULT_FEED) == wanted
+            ),
+            next(iter(clients), None),
+        )
+        if entry_id is None:
+            raise HomeAssistantError("Daily Activity Feed integration not configured")
+    
+    return hass.config_entries.async_get_entry(entry_id), clients[entry_id], feed
+
+
+def _parse_timestamp(timestamp: str) -> datetime | None:
+    """Return when an event happened from add_event's timestamp, or None if it can't be parsed.
+
+    A time of day (HH:MM or HH:MM:SS) is today's; a full date and time is
+    taken as is, in Home Assistant's time zone unless it has its own.
+    """
+    time_of_day = dt_util.parse_time(timestamp)
+    if time_of_day is not None:
+        return datetime.combine(dt_util.now().date(), time_of_day, dt_util.DEFAULT_TIME_ZONE)
+    occurred_at = dt_util.parse_datetime(timestamp)
+    if occurred_at is not None and occurred_at.tzinfo is None:
+        occurred_at = occurred_at.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+    return occurred_at
+
+
 async def _async_register_services(hass: HomeAssistant) -> None:
     """Register integration services."""
     
@@ -76,83 +229,83 @@ async def _async_register_services(hass: HomeAssistant) -> None:
         timestamp = call.data.get(ATTR_TIMESTAMP)
         priority = call.data.get(ATTR_PRIORITY, "normal")
         
-        # Get the first configured entry
-        entries = hass.config_entries.async_entries(DOMAIN)
-        if not entries:
-            raise HomeAssistantError("Daily Activity Feed integration not configured")
-        
-        entry = entries[0]
-        addon_url = entry.data[CONF_ADDON_URL]
+        entry, _, feed = _async_get_target(hass, call)
+        outbox: DailyActivityFeedOutbox = hass.data[DATA_OUTBOXES][entry.entry_id]
         
-        # Handle camera snapshot if camera_entity is provided
+        # Take the camera snapshot in the background; the event is posted
+        # right away with a stand-in image URL and updated once it is ready
+        event_id = None
+        capture = None
         if camera_entity and not image:
-            try:
-                # Generate unique filename
-                timestamp_str = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"/config/www/daf_{timestamp_str}.jpg"
-                
-                # Take snapshot
-                await hass.services.async_call(
-                    "camera",
-                    "snapshot",
-                    {
-                        "entity_id": camera_entity,
-                        "filename": filename,
-                    },
-                    blocking=True,
-                )
-                
-                # Set image path
-                image = f"/local/daf_{timestamp_str}.jpg"
-                _LOGGER.info("Camera snapshot created: %s", image)
-                
-            except Exception as err:
-                _LOGGER.error("Failed to create camera snapshot: %s", err)
-                # Continue without image
-        
-        # Generate timestamp if not provided
-        if not timestamp:
-            timestamp = datetime.now().strftime('%H:%M:%S')
+            snapshots: SnapshotManager = hass.data[DATA_SNAPSHOTS]
+            event_id = uuid.uuid4().hex
+            capture = snapshots.async_start_capture(camera_entity, event_id)
+            image = snapshots.pending_url(event_id)
         
         # Prepare payload
         payload = {
             "type": event_type,
             "title": title,
             "text": text,
-            "timestamp": timestamp,
         }
         
+        # A custom time is today's; otherwise the outbox dates the event
+        # when it is queued
+        if timestamp:
+            occurred_at = _parse_timestamp(timestamp)
+            if occurred_at is None:
+                _LOGGER.warning(
+                    "Ignoring timestamp %r of event %s, expected HH:MM:SS or a date and time",
+                    timestamp,
+                    title,
+                )
+            else:
+                payload["occurred_at"] = occurred_at.isoformat()
+        
         if image:
             payload["image"] = image
         
+        if event_id:
+            payload["id"] = event_id
+        
         if priority != "normal":
             payload["priority"] = priority
         
-        # Send to add-on API
+        # Queue for the add-on; the action doesn't wait for it to be sent
+        outbox.async_add_event(payload, feed)
+        _LOGGER.info("Event queued: %s - %s", event_type, title)
+        
+        if capture is not None:
+            entry.async_create_background_task(
+                hass,
+                _async_attach_snapshot(outbox, event_id, capture, feed),
+                f"{DOMAIN}_snapshot_{event_id}",
+            )
+    
+    async def async_handle_get_events(call: ServiceCall) -> ServiceResponse:
+        """Handle the get_events service call."""
+        _, client, feed = _async_get_target(hass, call)
+        
+        params = {}
+        if ATTR_TYPE in call.data:
+            params["type"] = ",".join(call.data[ATTR_TYPE])
+        if ATTR_PRIORITY in call.data:
+            params["priority"] = ",".join(call.data[ATTR_PRIORITY])
+        if ATTR_LIMIT in call.data:
+            params["limit"] = str(call.data[ATTR_LIMIT])
+        if ATTR_CURSOR in call.data:
+            params["cursor"] = str(call.data[ATTR_CURSOR])
+        
         try:
-            session = async_get_clientsession(hass)
-            url = f"{addon_url}/api/event"
-            
-            async with async_timeout.timeout(10):
-                async with session.post(url, json=payload) as response:
-                    if response.status not in (200, 201):
-                        error_text = await response.text()
-                        raise HomeAssistantError(
-                            f"Failed to add event: HTTP {response.status} - {error_text}"
-                        )
-                    
-                    _LOGGER.info(
-                        "Event added successfully: %s - %s", event_type, title
-                    )
-                    
+            return await client.async_get_events(call.data[ATTR_DAY], params, feed)
+        except DailyActivityFeedApiError as err:
+            raise HomeAssistantError(str(err)) from err
         except aiohttp.ClientError as err:
             raise HomeAssistantError(f"Connection error: {err}") from err
         except asyncio.TimeoutError as err:
             raise HomeAssistantError(f"Request timeout: {err}") from err
-        except Exception as err:
-            raise HomeAssistantError(f"Unexpected error: {err}") from err
     
-    # Register the service with inline field definitions
+    # Register the services with inline field definitions
     hass.services.async_register(
         DOMAIN,
         SERVICE_ADD_EVENT,
@@ -160,7 +313,34 @@ async def _async_register_services(hass: HomeAssistant) -> None:
         schema=SERVICE_ADD_EVENT_SCHEMA,
     )
     
-    _LOGGER.info("Service 'add_event' registered successfully")
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_EVENTS,
+        async_handle_get_events,
+        schema=SERVICE_GET_EVENTS_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    
+    _LOGGER.info("Services 'add_event' and 'get_events' registered successfully")
+
+
+async def _async_attach_snapshot(
+    outbox: DailyActivityFeedOutbox,
+    event_id: str,
+    capture: asyncio.Task,
+    feed: str | None = None,
+) -> None:
+    """Replace an event's stand-in image once its snapshot is taken."""
+    try:
+        image, thumbnail = await capture
+        _LOGGER.info("Camera snapshot created: %s", image)
+    except Exception as err:  # pylint: disable=broad-except
+        _LOGGER.error("Failed to create camera snapshot: %s", err)
+        image, thumbnail = None, None
+    
+    outbox.async_update_event(
+        event_id, {"image": image, "thumbnail": thumbnail}, feed
+    )
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
@@ -168,16 +348,26 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        outbox: DailyActivityFeedOutbox = hass.data[DATA_OUTBOXES].pop(entry.entry_id)
+        await outbox.async_close()
+        client: DailyActivityFeedApiClient = hass.data[DOMAIN].pop(entry.entry_id)
+        await client.async_close()
+        hass.data[DATA_SNAPSHOTS].remove(entry.entry_id)
         
         # Unregister services if no more entries
         if not hass.config_entries.async_entries(DOMAIN):
             hass.services.async_remove(DOMAIN, SERVICE_ADD_EVENT)
-            _LOGGER.info("Service 'add_event' unregistered")
+            hass.services.async_remove(DOMAIN, SERVICE_GET_EVENTS)
+            _LOGGER.info("Services 'add_event' and 'get_events' unregistered")
     
     return unload_ok
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Delete the outbox of a removed config entry."""
+    await outbox_store(hass, entry.entry_id).async_remove()
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Reload config entry."""
     await async_unload_entry(hass, entry)
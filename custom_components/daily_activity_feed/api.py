@@ -0,0 +1,186 @@
+"""HTTP client for the Daily Activity Feed add-on"""
+from __future__ import annotations
+
+import logging
+from types import SimpleNamespace
+from typing import Any
+
+import aiohttp
+import async_timeout
+
+from homeassistant.helpers.json import json_dumps
+from homeassistant.util.json import json_loads
+
+from .const import (
+    DEFAULT_FEED,
+    DEFAULT_KEEPALIVE_TIMEOUT,
+    DEFAULT_RETENTION_DAYS,
+    REQUEST_TIMEOUT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DailyActivityFeedApiError(Exception):
+    """The add-on answered a request with an error."""
+
+    def __init__(self, message: str, status: int | None = None) -> None:
+        """Initialize."""
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        """Return whether sending the same request again may succeed."""
+        return self.status is None or self.status >= 500 or self.status in (408, 429)
+
+
+class DailyActivityFeedApiClient:
+    """Talk to the add-on over one keep-alive connection pool.
+
+    The coordinator, the event stream and the outbox of a config entry
+    all share this client, so polls reuse open connections
+    instead of opening a new socket every interval.
+
+    A client talks to one feed of the add-on (the default one unless
+    feed is set); requests can name another feed of the same add-on.
+    """
+
+    def __init__(
+        self, addon_url: str, max_connections: int, feed: str | None = None
+    ) -> None:
+        """Initialize."""
+        self.addon_url = addon_url
+        self.max_connections = max_connections
+        self.feed = feed
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.max_connections,
+                    keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                ),
+                trace_configs=[trace_config],
+                # orjson-backed, like the rest of Home Assistant
+                json_serialize=json_dumps,
+            )
+        return self._session
+
+    def url(self, path: str, feed: str | None = None) -> str:
+        """Return the full URL of an add-on API path in this client's feed or the given one."""
+        feed = feed or self.feed
+        if feed and feed != DEFAULT_FEED and path.startswith("/api/"):
+            path = f"/api/feeds/{feed}/{path[5:]}"
+        return f"{self.addon_url}{path}"
+
+    async def _on_connection_created(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceConnectionCreateEndParams,
+    ) -> None:
+        """Count a newly opened connection."""
+        self.connections_opened += 1
+        _LOGGER.debug(
+            "Opened connection to add-on (%s opened, %s reused)",
+            self.connections_opened,
+            self.connections_reused,
+        )
+
+    async def _on_connection_reused(
+        self,
+        session: aiohttp.ClientSession,
+        context: SimpleNamespace,
+        params: aiohttp.TraceConnectionReuseconnParams,
+    ) -> None:
+        """Count a request served over an already open connection."""
+        self.connections_reused += 1
+
+    async def async_add_events(
+        self, payloads: list[dict[str, Any]], feed: str | None = None
+    ) -> None:
+        """Add events to a feed, several at once as a single batch request."""
+        if len(payloads) == 1:
+            url, body = self.url("/api/event", feed), payloads[0]
+        else:
+            url, body = self.url("/api/events/batch", feed), payloads
+
+        async with async_timeout.timeout(REQUEST_TIMEOUT):
+            async with self.session.post(url, json=body) as response:
+                if response.status not in (200, 201):
+                    error_text = await response.text()
+                    raise DailyActivityFeedApiError(
+                        f"Failed to add event: HTTP {response.status} - {error_text}",
+                        response.status,
+                    )
+
+    async def async_update_event(
+        self, event_id: str, changes: dict[str, Any], feed: str | None = None
+    ) -> None:
+        """Change the image fields of an event added with an id."""
+        async with async_timeout.timeout(REQUEST_TIMEOUT):
+            async with self.session.patch(
+                self.url(f"/api/event/{event_id}", feed), json=changes
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise DailyActivityFeedApiError(
+                        f"Failed to update event: HTTP {response.status} - {error_text}",
+                        response.status,
+                    )
+
+    async def async_get_events(
+        self, day: str, params: dict[str, str], feed: str | None = None
+    ) -> dict[str, Any]:
+        """Return one day of events (today, yesterday or YYYY-MM-DD) from the add-on."""
+        async with async_timeout.timeout(REQUEST_TIMEOUT):
+            async with self.session.get(
+                self.url(f"/api/events/{day}", feed), params=params
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise DailyActivityFeedApiError(
+                        f"Failed to get events: HTTP {response.status} - {error_text}",
+                        response.status,
+                    )
+                return await response.json(loads=json_loads)
+
+    async def async_get_feeds(self) -> list[dict[str, Any]]:
+        """Return the add-on's feeds with their limits."""
+        async with async_timeout.timeout(REQUEST_TIMEOUT):
+            async with self.session.get(f"{self.addon_url}/api/feeds") as response:
+                if response.status == 404:
+                    # Add-on from before named feeds
+                    return [{"name": DEFAULT_FEED, "retention_days": DEFAULT_RETENTION_DAYS}]
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise DailyActivityFeedApiError(
+                        f"Failed to get feeds: HTTP {response.status} - {error_text}",
+                        response.status,
+                    )
+                data = await response.json(loads=json_loads)
+                return data["feeds"]
+
+    def stats(self) -> dict[str, Any]:
+        """Return connection pool statistics."""
+        return {
+            "max_connections": self.max_connections,
+            "connections_opened": self.connections_opened,
+            "connections_reused": self.connections_reused,
+        }
+
+    async def async_close(self) -> None:
+        """Close the pooled session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
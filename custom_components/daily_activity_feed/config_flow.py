@@ -9,14 +9,27 @@ import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import (
     DOMAIN,
     CONF_ADDON_URL,
     CONF_SCAN_INTERVAL,
+    CONF_MAX_CONNECTIONS,
+    CONF_FEED,
+    CONF_MAX_ENTRIES,
+    CONF_EVENT_TYPES,
+    CONF_PRIORITIES,
+    CONF_FIELDS,
+    CONF_SNAPSHOT_MAX_MB,
     DEFAULT_ADDON_URL,
+    DEFAULT_FEED,
     DEFAULT_SCAN_INTERVAL,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_SNAPSHOT_MAX_MB,
+    PRIORITIES,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -34,17 +47,26 @@ class DailyActivityFeedConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         errors = {}
 
         if user_input is not None:
-            # Validate the addon URL
+            # Validate the addon URL and the feed
             addon_url = user_input[CONF_ADDON_URL]
+            feed = user_input.pop(CONF_FEED, "").strip() or DEFAULT_FEED
+            feeds = await self._async_get_feeds(addon_url)
             
-            if await self._test_connection(addon_url):
+            if feeds is None:
+                errors["base"] = "cannot_connect"
+            elif feed not in feeds:
+                errors[CONF_FEED] = "unknown_feed"
+            elif feed == DEFAULT_FEED:
                 # Create entry
                 return self.async_create_entry(
                     title="Daily Activity Feed",
                     data=user_input,
                 )
             else:
-                errors["base"] = "cannot_connect"
+                return self.async_create_entry(
+                    title=f"Daily Activity Feed ({feed})",
+                    data={**user_input, CONF_FEED: feed},
+                )
 
         # Show form
         data_schema = vol.Schema(
@@ -55,6 +77,10 @@ class DailyActivityFeedConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 vol.Optional(
                     CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL
                 ): vol.All(vol.Coerce(int), vol.Range(min=10, max=300)),
+                vol.Optional(
+                    CONF_MAX_CONNECTIONS, default=DEFAULT_MAX_CONNECTIONS
+                ): vol.All(vol.Coerce(int), vol.Range(min=2, max=20)),
+                vol.Optional(CONF_FEED, default=""): str,
             }
         )
 
@@ -64,16 +90,22 @@ class DailyActivityFeedConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors=errors,
         )
 
-    async def _test_connection(self, addon_url: str) -> bool:
-        """Test if we can connect to the addon."""
+    async def _async_get_feeds(self, addon_url: str) -> list[str] | None:
+        """Return the names of the add-on's feeds, or None if it can't be reached."""
         try:
             session = async_get_clientsession(self.hass)
             async with async_timeout.timeout(10):
-                async with session.get(f"{addon_url}/") as response:
-                    return response.status == 200
+                async with session.get(f"{addon_url}/api/feeds") as response:
+                    if response.status == 404:
+                        # Add-on from before named feeds
+                        return [DEFAULT_FEED]
+                    if response.status != 200:
+                        return None
+                    data = await response.json()
+                    return [feed["name"] for feed in data["feeds"]]
         except Exception as err:
             _LOGGER.error("Error testing connection: %s", err)
-            return False
+            return None
 
     @staticmethod
     @callback
@@ -98,22 +130,49 @@ class DailyActivityFeedOptionsFlow(config_entries.OptionsFlow):
         if user_input is not None:
             return self.async_create_entry(title="", data=user_input)
 
+        # Connection settings start out in the entry's data until first changed here
+        config = {**self.config_entry.data, **self.config_entry.options}
+
         return self.async_show_form(
             step_id="init",
             data_schema=vol.Schema(
                 {
                     vol.Required(
                         CONF_ADDON_URL,
-                        default=self.config_entry.data.get(
-                            CONF_ADDON_URL, DEFAULT_ADDON_URL
-                        ),
+                        default=config.get(CONF_ADDON_URL, DEFAULT_ADDON_URL),
                     ): str,
                     vol.Optional(
                         CONF_SCAN_INTERVAL,
-                        default=self.config_entry.data.get(
-                            CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL
-                        ),
+                        default=config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL),
                     ): vol.All(vol.Coerce(int), vol.Range(min=10, max=300)),
+                    vol.Optional(
+                        CONF_MAX_CONNECTIONS,
+                        default=config.get(CONF_MAX_CONNECTIONS, DEFAULT_MAX_CONNECTIONS),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=2, max=20)),
+                    vol.Optional(
+                        CONF_MAX_ENTRIES,
+                        default=self.config_entry.options.get(
+                            CONF_MAX_ENTRIES, DEFAULT_MAX_ENTRIES
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0, max=1000)),
+                    vol.Optional(
+                        CONF_EVENT_TYPES,
+                        default=self.config_entry.options.get(CONF_EVENT_TYPES, ""),
+                    ): str,
+                    vol.Optional(
+                        CONF_PRIORITIES,
+                        default=self.config_entry.options.get(CONF_PRIORITIES, []),
+                    ): cv.multi_select({priority: priority.capitalize() for priority in PRIORITIES}),
+                    vol.Optional(
+                        CONF_FIELDS,
+                        default=self.config_entry.options.get(CONF_FIELDS, ""),
+                    ): str,
+                    vol.Optional(
+                        CONF_SNAPSHOT_MAX_MB,
+                        default=self.config_entry.options.get(
+                            CONF_SNAPSHOT_MAX_MB, DEFAULT_SNAPSHOT_MAX_MB
+                        ),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=10, max=10000)),
                 }
             ),
         )
@@ -5,10 +5,65 @@ DOMAIN = "daily_activity_feed"
 # Configuration
 CONF_ADDON_URL = "addon_url"
 CONF_SCAN_INTERVAL = "scan_interval"
+CONF_MAX_CONNECTIONS = "max_connections"
+CONF_FEED = "feed"
+CONF_MAX_ENTRIES = "max_entries"
+CONF_EVENT_TYPES = "event_types"
+CONF_PRIORITIES = "priorities"
+CONF_FIELDS = "fields"
+CONF_SNAPSHOT_MAX_MB = "snapshot_max_mb"
 
 # Defaults
 DEFAULT_ADDON_URL = "http://addon-daily-activity-feed:8099"
 DEFAULT_SCAN_INTERVAL = 30
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_MAX_ENTRIES = 0  # 0 = all events
+
+# Feed served under /api; named feeds are under /api/feeds/<name>
+DEFAULT_FEED = "default"
+
+DEFAULT_SNAPSHOT_MAX_MB = 200
+# Snapshots are kept as long as the add-on keeps events; add-ons from
+# before named feeds don't tell, and keep them this long by default
+DEFAULT_RETENTION_DAYS = 7
+
+PRIORITIES = ["low", "normal", "high"]
+
+# Idle pooled connections outlive the longest scan interval (300s) so polls
+# can reuse them; the add-on keeps idle connections open for 330s
+DEFAULT_KEEPALIVE_TIMEOUT = 310
+
+# Requests to the add-on
+REQUEST_TIMEOUT = 10
+
+# add_event calls arriving within this window are sent as one batch
+BATCH_WINDOW = 0.05
+BATCH_MAX_SIZE = 50
+
+# Outbox of changes waiting to be sent, kept in .storage across restarts
+DATA_OUTBOXES = f"{DOMAIN}_outboxes"
+OUTBOX_STORAGE_VERSION = 1
+OUTBOX_MAX_SIZE = 1000  # the oldest changes are dropped beyond this
+OUTBOX_SAVE_DELAY = 1
+# Retries wait 1, 2, 4, ... seconds; after CIRCUIT_FAILURES failures in a
+# row the sender pauses for CIRCUIT_OPEN_TIME, then tries a single change
+RETRY_DELAY = 1
+CIRCUIT_FAILURES = 5
+CIRCUIT_OPEN_TIME = 60
+
+# Event stream
+STREAM_READ_TIMEOUT = 60  # add-on sends a keepalive every 25 seconds
+STREAM_RECONNECT_MAX = 60
+
+# Camera snapshots, stored in <config>/daily_activity_feed/snapshots
+DATA_SNAPSHOTS = f"{DOMAIN}_snapshots"
+SNAPSHOT_URL = "/api/daily_activity_feed/snapshots"
+# Snapshot files never change once written
+SNAPSHOT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Longest a request for a pending snapshot waits for the camera
+PENDING_SNAPSHOT_TIMEOUT = 15
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 75
 
 # Sensor
 SENSOR_TODAY = "today"
@@ -16,6 +71,7 @@ SENSOR_YESTERDAY = "yesterday"
 
 # Services
 SERVICE_ADD_EVENT = "add_event"
+SERVICE_GET_EVENTS = "get_events"
 
 # Service Attributes
 ATTR_TYPE = "type"
@@ -25,3 +81,8 @@ ATTR_IMAGE = "image"
 ATTR_CAMERA_ENTITY = "camera_entity"
 ATTR_TIMESTAMP = "timestamp"
 ATTR_PRIORITY = "priority"
+ATTR_DAY = "day"
+ATTR_LIMIT = "limit"
+ATTR_CURSOR = "cursor"
+ATTR_FEED = "feed"
+ATTR_CONFIG_ENTRY = "config_entry_id"
@@ -0,0 +1,28 @@
+"""Diagnostics support for Daily Activity Feed"""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .api import DailyActivityFeedApiClient
+from .const import DATA_OUTBOXES, DATA_SNAPSHOTS, DOMAIN
+from .outbox import DailyActivityFeedOutbox
+from .snapshots import SnapshotManager
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    client: DailyActivityFeedApiClient = hass.data[DOMAIN][entry.entry_id]
+    outbox: DailyActivityFeedOutbox = hass.data[DATA_OUTBOXES][entry.entry_id]
+    snapshots: SnapshotManager = hass.data[DATA_SNAPSHOTS]
+    
+    return {
+        "config": {**entry.data, **entry.options},
+        "connection_pool": client.stats(),
+        "outbox": {"queued": len(outbox), **outbox.status()},
+        "snapshots": snapshots.stats(),
+    }
@@ -0,0 +1,264 @@
+"""Outbound queue of changes for the Daily Activity Feed add-on"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+import aiohttp
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .api import DailyActivityFeedApiClient, DailyActivityFeedApiError
+from .const import (
+    BATCH_MAX_SIZE,
+    BATCH_WINDOW,
+    CIRCUIT_FAILURES,
+    CIRCUIT_OPEN_TIME,
+    DOMAIN,
+    OUTBOX_MAX_SIZE,
+    OUTBOX_SAVE_DELAY,
+    OUTBOX_STORAGE_VERSION,
+    RETRY_DELAY,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Circuit states: sending normally, paused after repeated failures, and
+# trying a single change after the pause
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+def outbox_store(hass: HomeAssistant, entry_id: str) -> Store:
+    """Return the storage file of a config entry's outbox."""
+    return Store(hass, OUTBOX_STORAGE_VERSION, f"{DOMAIN}.outbox.{entry_id}")
+
+
+class DailyActivityFeedOutbox:
+    """Queue events and image updates for the add-on and send them in the background.
+
+    Services only append to the queue, so an automation never waits for
+    the add-on, even while it restarts. A sender drains the queue in
+    order, posting consecutive events of one feed as a single batch.
+    Failed sends are retried with exponential backoff; after
+    CIRCUIT_FAILURES failures in a row the circuit opens and the sender
+    pauses for CIRCUIT_OPEN_TIME, then probes with a single change.
+    Changes the add-on rejects outright (4xx) are dropped; a rejected
+    batch is resent one event at a time so only the bad one is lost.
+
+    The queue is kept in .storage, so queued changes survive restarts.
+    It holds at most OUTBOX_MAX_SIZE changes; beyond that the oldest are
+    dropped. Every event gets an id, which the add-on uses to recognize
+    a batch resent after its response was lost, and the time it was
+    queued.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        client: DailyActivityFeedApiClient,
+    ) -> None:
+        """Initialize."""
+        self.hass = hass
+        self.entry = entry
+        self.client = client
+        self._store = outbox_store(hass, entry.entry_id)
+        self._queue: deque[dict[str, Any]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._listeners: list[CALLBACK_TYPE] = []
+        # Changes to send one at a time, to find the one a batch was rejected for
+        self._singles = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.failures = 0
+        self.sent = 0
+        self.dropped = 0
+        self.last_error: str | None = None
+        self.next_attempt: datetime | None = None
+
+    def __len__(self) -> int:
+        """Return the number of queued changes."""
+        return len(self._queue)
+
+    async def async_load(self) -> None:
+        """Restore the changes queued before the last shutdown."""
+        data = await self._store.async_load()
+        if data:
+            self._queue.extend(data["queue"])
+        if self._queue:
+            _LOGGER.info("%s change(s) queued for the add-on", len(self._queue))
+
+    @callback
+    def async_start(self) -> None:
+        """Start sending in the background."""
+        self._task = self.entry.async_create_background_task(
+            self.hass, self._async_run(), f"{DOMAIN}_outbox_{self.entry.entry_id}"
+        )
+
+    async def async_close(self) -> None:
+        """Stop sending and save what is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._store.async_save(self._data_to_save())
+
+    @callback
+    def async_add_event(self, payload: dict[str, Any], feed: str | None = None) -> None:
+        """Queue an event for a feed (the client's feed if None).
+
+        The event is dated now unless it has an occurred_at, so the add-on
+        files it under the time it happened rather than when it arrives.
+        """
+        payload = {"id": uuid.uuid4().hex, "occurred_at": dt_util.now().isoformat(), **payload}
+        self._async_enqueue({"op": "add", "feed": feed, "event": payload})
+
+    @callback
+    def async_update_event(
+        self, event_id: str, changes: dict[str, Any], feed: str | None = None
+    ) -> None:
+        """Queue a change to the image fields of a queued or stored event."""
+        self._async_enqueue(
+            {"op": "update", "feed": feed, "id": event_id, "changes": changes}
+        )
+
+    @callback
+    def async_add_listener(self, listener: CALLBACK_TYPE) -> Callable[[], None]:
+        """Call listener whenever the queue or the sender's state changes."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def status(self) -> dict[str, Any]:
+        """Return the sender's state."""
+        return {
+            "circuit": self.circuit,
+            "failures": self.failures,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+            "next_attempt": self.next_attempt.isoformat() if self.next_attempt else None,
+        }
+
+    @callback
+    def _async_enqueue(self, change: dict[str, Any]) -> None:
+        """Append a change, dropping the oldest one if the queue is full."""
+        if len(self._queue) >= OUTBOX_MAX_SIZE:
+            dropped = self._queue.popleft()
+            self.dropped += 1
+            _LOGGER.warning(
+                "Outbox full (%s changes), dropped the oldest %s", OUTBOX_MAX_SIZE, dropped["op"]
+            )
+        self._queue.append(change)
+        self._store.async_delay_save(self._data_to_save, OUTBOX_SAVE_DELAY)
+        self._async_notify()
+        self._wakeup.set()
+
+    @callback
+    def _async_notify(self) -> None:
+        """Tell the listeners that the queue or the sender's state changed."""
+        for listener in list(self._listeners):
+            listener()
+
+    def _data_to_save(self) -> dict[str, Any]:
+        """Return the queue as it is stored."""
+        return {"queue": list(self._queue)}
+
+    def _next_batch(self) -> list[dict[str, Any]]:
+        """Return the changes at the head of the queue that go in one request."""
+        head = self._queue[0]
+        if head["op"] != "add" or self.circuit == CIRCUIT_HALF_OPEN or self._singles:
+            return [head]
+        batch = []
+        for change in self._queue:
+            if change["op"] != "add" or change["feed"] != head["feed"]:
+                break
+            batch.append(change)
+            if len(batch) >= BATCH_MAX_SIZE:
+                break
+        return batch
+
+    async def _async_send(self, batch: list[dict[str, Any]]) -> None:
+        """Send one batch of changes to the add-on."""
+        head = batch[0]
+        if head["op"] == "add":
+            await self.client.async_add_events(
+                [change["event"] for change in batch], head["feed"]
+            )
+        else:
+            await self.client.async_update_event(head["id"], head["changes"], head["feed"])
+
+    async def _async_run(self) -> None:
+        """Send the queue in order until cancelled."""
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                # Let events triggered together arrive, to send them as one batch
+                await asyncio.sleep(BATCH_WINDOW)
+                continue
+
+            batch = self._next_batch()
+            try:
+                await self._async_send(batch)
+            except asyncio.CancelledError:
+                raise
+            except DailyActivityFeedApiError as err:
+                if err.retryable:
+                    await self._async_failed(err)
+                    continue
+                if len(batch) > 1:
+                    self._singles = len(batch)
+                    continue
+                _LOGGER.error("Add-on rejected %s queued change(s): %s", len(batch), err)
+                self.last_error = str(err)
+                self.dropped += len(batch)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                await self._async_failed(err)
+                continue
+            else:
+                self.sent += len(batch)
+                if self.circuit != CIRCUIT_CLOSED:
+                    _LOGGER.info("Add-on reachable again, sending %s queued change(s)", len(self._queue))
+
+            self._singles = max(self._singles - 1, 0)
+            # Changes may have been dropped from the head while sending
+            for change in batch:
+                if self._queue and self._queue[0] is change:
+                    self._queue.popleft()
+            self.circuit = CIRCUIT_CLOSED
+            self.failures = 0
+            self.next_attempt = None
+            self._store.async_delay_save(self._data_to_save, OUTBOX_SAVE_DELAY)
+            self._async_notify()
+
+    async def _async_failed(self, err: Exception) -> None:
+        """Wait before the next attempt, opening the circuit after repeated failures."""
+        self.failures += 1
+        self.last_error = str(err) or type(err).__name__
+        if self.circuit == CIRCUIT_HALF_OPEN or self.failures >= CIRCUIT_FAILURES:
+            if self.circuit == CIRCUIT_CLOSED:
+                _LOGGER.warning(
+                    "Add-on unreachable (%s), keeping %s change(s) queued and retrying in %s seconds",
+                    self.last_error,
+                    len(self._queue),
+                    CIRCUIT_OPEN_TIME,
+                )
+            self.circuit = CIRCUIT_OPEN
+            delay = CIRCUIT_OPEN_TIME
+        else:
+            _LOGGER.debug("Sending to the add-on failed: %s", self.last_error)
+            delay = RETRY_DELAY * 2 ** (self.failures - 1)
+
+        self.next_attempt = dt_util.utcnow() + timedelta(seconds=delay)
+        self._async_notify()
+        await asyncio.sleep(delay)
+        if self.circuit == CIRCUIT_OPEN:
+            self.circuit = CIRCUIT_HALF_OPEN
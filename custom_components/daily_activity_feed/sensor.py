@@ -1,12 +1,16 @@
 """Sensor platform for Daily Activity Feed"""
 import logging
-from datetime import timedelta
+from datetime import date, timedelta
+from operator import itemgetter
+from typing import Any
+
 import aiohttp
 import async_timeout
 
-from homeassistant.components.sensor import SensorEntity
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.const import EntityCategory
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
@@ -14,19 +18,87 @@ from homeassistant.helpers.update_coordinator import (
     UpdateFailed,
 )
 from homeassistant.util import dt as dt_util
+from homeassistant.util.json import json_loads
 
+from .api import DailyActivityFeedApiClient
 from .const import (
     DOMAIN,
-    CONF_ADDON_URL,
+    DATA_OUTBOXES,
     CONF_SCAN_INTERVAL,
+    CONF_MAX_ENTRIES,
+    CONF_EVENT_TYPES,
+    CONF_PRIORITIES,
+    CONF_FIELDS,
+    CONF_FEED,
     DEFAULT_SCAN_INTERVAL,
     SENSOR_TODAY,
     SENSOR_YESTERDAY,
 )
+from .outbox import DailyActivityFeedOutbox
+from .stream import DailyActivityFeedStream
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _query_params(config: dict) -> dict[str, str]:
+    """Translate the entry options into add-on query parameters."""
+    params = {}
+    if config.get(CONF_MAX_ENTRIES):
+        params["limit"] = str(config[CONF_MAX_ENTRIES])
+    if config.get(CONF_EVENT_TYPES):
+        params["type"] = config[CONF_EVENT_TYPES].replace(" ", "")
+    if config.get(CONF_PRIORITIES):
+        params["priority"] = ",".join(config[CONF_PRIORITIES])
+    if config.get(CONF_FIELDS):
+        params["fields"] = config[CONF_FIELDS].replace(" ", "")
+    return params
+
+
+def _merge_delta(
+    data: dict[str, Any] | None, delta: dict[str, Any], limit: int | None
+) -> dict[str, Any]:
+    """Apply a since_seq response of the add-on to the cached days.
+
+    Clears and rollovers are replayed first, then new and updated events
+    are merged in by seq and the list is cut to the day's count. Tombstones
+    name dates rather than days, so replaying changes the stream already
+    applied is harmless.
+    """
+    days = (SENSOR_TODAY, SENSOR_YESTERDAY)
+    if delta["full"] or not data:
+        return {day: delta[day] for day in days}
+    
+    merged = {day: data.get(day) or {} for day in days}
+    for tombstone in delta["tombstones"]:
+        if tombstone["op"] == "clear":
+            for day in days:
+                if merged[day].get("date") == tombstone["date"]:
+                    merged[day] = {**merged[day], "events": []}
+        elif tombstone["op"] == "rollover":
+            today = merged[SENSOR_TODAY]
+            if today.get("date") == tombstone["date"]:
+                continue
+            yesterday_date = (date.fromisoformat(tombstone["date"]) - timedelta(days=1)).isoformat()
+            if today.get("date") != yesterday_date:
+                today = {"date": yesterday_date, "count": 0, "events": []}
+            merged = {
+                SENSOR_TODAY: {"date": tombstone["date"], "count": 0, "events": []},
+                SENSOR_YESTERDAY: today,
+            }
+    
+    for day in days:
+        changes = delta[day]
+        events = {event["seq"]: event for event in merged[day].get("events", [])}
+        events.update((event["seq"], event) for event in changes["events"])
+        size = changes["count"] if limit is None else min(changes["count"], limit)
+        merged[day] = {
+            "date": changes["date"],
+            "count": changes["count"],
+            "events": sorted(events.values(), key=itemgetter("seq"), reverse=True)[:size],
+        }
+    return merged
+
+
 async def async_setup_entry(
     hass: HomeAssistant,
     entry: ConfigEntry,
@@ -34,35 +106,55 @@ async def async_setup_entry(
 ) -> None:
     """Set up Daily Activity Feed sensors based on a config entry."""
     
-    addon_url = entry.data[CONF_ADDON_URL]
-    scan_interval = entry.data.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+    config = {**entry.data, **entry.options}
+    scan_interval = config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+    client: DailyActivityFeedApiClient = hass.data[DOMAIN][entry.entry_id]
     
-    # Create coordinators for today and yesterday
-    coordinator_today = DailyActivityFeedDataUpdateCoordinator(
+    # One coordinator fetches both days for both sensors
+    coordinator = DailyActivityFeedDataUpdateCoordinator(
         hass,
-        addon_url,
-        SENSOR_TODAY,
+        client,
         scan_interval,
+        _query_params(config),
     )
     
-    coordinator_yesterday = DailyActivityFeedDataUpdateCoordinator(
+    # Fetch initial data
+    await coordinator.async_config_entry_first_refresh()
+    
+    # Counts by type, priority and hour, refetched whenever the feed changes
+    stats_coordinator = DailyActivityFeedStatsCoordinator(
         hass,
-        addon_url,
-        SENSOR_YESTERDAY,
+        client,
         scan_interval,
+        {key: value for key, value in coordinator.params.items() if key in ("type", "priority")},
     )
+    await stats_coordinator.async_config_entry_first_refresh()
     
-    # Fetch initial data
-    await coordinator_today.async_config_entry_first_refresh()
-    await coordinator_yesterday.async_config_entry_first_refresh()
+    @callback
+    def _async_feed_updated() -> None:
+        """Refresh the statistics after the feed changed."""
+        hass.async_create_task(stats_coordinator.async_request_refresh())
     
-    # Create sensor entities
+    entry.async_on_unload(coordinator.async_add_listener(_async_feed_updated))
+    
+    # Create sensor entities, named after the feed when it isn't the default one
+    feed = config.get(CONF_FEED)
+    prefix = f"{feed.replace('_', ' ').title()} " if feed else ""
     sensors = [
-        DailyActivityFeedSensor(coordinator_today, entry, SENSOR_TODAY, "Today"),
-        DailyActivityFeedSensor(coordinator_yesterday, entry, SENSOR_YESTERDAY, "Yesterday"),
+        DailyActivityFeedSensor(coordinator, entry, SENSOR_TODAY, f"{prefix}Today"),
+        DailyActivityFeedSensor(coordinator, entry, SENSOR_YESTERDAY, f"{prefix}Yesterday"),
+        DailyActivityFeedStatsSensor(stats_coordinator, entry, SENSOR_TODAY, f"{prefix}Today"),
+        DailyActivityFeedStatsSensor(stats_coordinator, entry, SENSOR_YESTERDAY, f"{prefix}Yesterday"),
+        DailyActivityFeedOutboxSensor(hass.data[DATA_OUTBOXES][entry.entry_id], entry, prefix),
     ]
     
     async_add_entities(sensors)
+    
+    # Receive changes pushed by the add-on; polling is only the fallback
+    stream = DailyActivityFeedStream(client, coordinator)
+    entry.async_create_background_task(
+        hass, stream.async_run(), f"{DOMAIN}_stream_{entry.entry_id}"
+    )
 
 
 class DailyActivityFeedDataUpdateCoordinator(DataUpdateCoordinator):
@@ -71,34 +163,127 @@ class DailyActivityFeedDataUpdateCoordinator(DataUpdateCoordinator):
     def __init__(
         self,
         hass: HomeAssistant,
-        addon_url: str,
-        day: str,
+        client: DailyActivityFeedApiClient,
         scan_interval: int,
+        params: dict[str, str] | None = None,
     ) -> None:
         """Initialize."""
-        self.addon_url = addon_url
-        self.day = day
+        self.client = client
+        self.params = params or {}
+        self._etag: str | None = None
+        # Latest add-on seq merged into data, and the add-on run it belongs to
+        self._seq = 0
+        self._instance: str | None = None
         
         super().__init__(
             hass,
             _LOGGER,
-            name=f"{DOMAIN}_{day}",
+            name=DOMAIN,
             update_interval=timedelta(seconds=scan_interval),
+            always_update=False,
         )
 
     async def _async_update_data(self):
-        """Fetch data from API endpoint."""
+        """Fetch what changed since the last update and merge it."""
         try:
-            url = f"{self.addon_url}/api/events/{self.day}"
+            since_seq = self._seq if self.data is not None else 0
+            delta = await self._async_fetch(since_seq)
+            if delta is None:
+                return self.data
+            
+            if since_seq and not delta["full"] and delta["instance"] != self._instance:
+                # The add-on restarted and numbers its changes anew
+                since_seq = 0
+                delta = await self._async_fetch(since_seq)
             
+            data = _merge_delta(
+                self.data if since_seq else None,
+                delta,
+                int(self.params["limit"]) if "limit" in self.params else None,
+            )
+            self._seq = delta["seq"]
+            self._instance = delta["instance"]
+            return data
+        
+        except UpdateFailed:
+            raise
+        
+        except aiohttp.ClientError as err:
+            raise UpdateFailed(f"Error connecting to addon: {err}")
+        
+        except Exception as err:
+            raise UpdateFailed(f"Unexpected error: {err}")
+
+    async def _async_fetch(self, since_seq: int) -> dict[str, Any] | None:
+        """Request the changes after since_seq, or None if there are none."""
+        headers = {}
+        if self._etag and since_seq:
+            headers["If-None-Match"] = self._etag
+        
+        async with async_timeout.timeout(10):
+            async with self.client.session.get(
+                self.client.url("/api/events"),
+                params={**self.params, "since_seq": str(since_seq)},
+                headers=headers,
+            ) as response:
+                # Feed unchanged since the last poll
+                if response.status == 304:
+                    return None
+                
+                if response.status != 200:
+                    raise UpdateFailed(f"Error fetching data: HTTP {response.status}")
+                
+                self._etag = response.headers.get("ETag")
+                return await response.json(loads=json_loads)
+
+
+class DailyActivityFeedStatsCoordinator(DataUpdateCoordinator):
+    """Class to manage fetching the event counts of today and yesterday."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: DailyActivityFeedApiClient,
+        scan_interval: int,
+        params: dict[str, str] | None = None,
+    ) -> None:
+        """Initialize."""
+        self.client = client
+        self.params = params or {}
+        self._etag: str | None = None
+        
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN}_stats",
+            update_interval=timedelta(seconds=scan_interval),
+            always_update=False,
+        )
+
+    async def _async_update_data(self):
+        """Fetch the counts unless they are unchanged since the last update."""
+        headers = {}
+        if self._etag and self.data is not None:
+            headers["If-None-Match"] = self._etag
+        
+        try:
             async with async_timeout.timeout(10):
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as response:
-                        if response.status != 200:
-                            raise UpdateFailed(f"Error fetching data: HTTP {response.status}")
-                        
-                        data = await response.json()
-                        return data
+                async with self.client.session.get(
+                    self.client.url("/api/stats"),
+                    params=self.params,
+                    headers=headers,
+                ) as response:
+                    if response.status == 304:
+                        return self.data
+                    
+                    if response.status != 200:
+                        raise UpdateFailed(f"Error fetching stats: HTTP {response.status}")
+                    
+                    self._etag = response.headers.get("ETag")
+                    return await response.json(loads=json_loads)
+        
+        except UpdateFailed:
+            raise
         
         except aiohttp.ClientError as err:
             raise UpdateFailed(f"Error connecting to addon: {err}")
@@ -110,6 +295,10 @@ class DailyActivityFeedDataUpdateCoordinator(DataUpdateCoordinator):
 class DailyActivityFeedSensor(CoordinatorEntity, SensorEntity):
     """Representation of a Daily Activity Feed Sensor."""
 
+    # The entries can hold hundreds of events; keep them out of the
+    # recorder database (the get_events action serves the full history)
+    _unrecorded_attributes = frozenset({"entries", "last_updated"})
+
     def __init__(
         self,
         coordinator: DailyActivityFeedDataUpdateCoordinator,
@@ -124,18 +313,41 @@ class DailyActivityFeedSensor(CoordinatorEntity, SensorEntity):
         self._attr_name = f"Daily Activity {name_suffix}"
         self._attr_unique_id = f"{entry.entry_id}_{day}"
         self._attr_icon = "mdi:format-list-bulleted"
+        self._last_data = self._day_data
+        self._last_updated = dt_util.now().isoformat() if self._last_data else None
+        self._last_available = self.available
+
+    @property
+    def _day_data(self):
+        """Return this sensor's day from the shared coordinator data."""
+        if self.coordinator.data:
+            return self.coordinator.data.get(self._day)
+        return None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write a new state only when this sensor's day or availability changed."""
+        day_data = self._day_data
+        available = self.available
+        if day_data == self._last_data and available == self._last_available:
+            return
+        if day_data != self._last_data:
+            self._last_data = day_data
+            self._last_updated = dt_util.now().isoformat()
+        self._last_available = available
+        super()._handle_coordinator_update()
 
     @property
     def native_value(self):
         """Return the state of the sensor."""
-        if self.coordinator.data:
-            return self.coordinator.data.get("count", 0)
+        if self._day_data:
+            return self._day_data.get("count", 0)
         return 0
 
     @property
     def extra_state_attributes(self):
         """Return the state attributes."""
-        if not self.coordinator.data:
+        if not self._day_data:
             return {
                 "entries": [],
                 "date": None,
@@ -143,7 +355,89 @@ class DailyActivityFeedSensor(CoordinatorEntity, SensorEntity):
             }
         
         return {
-            "entries": self.coordinator.data.get("events", []),
-            "date": self.coordinator.data.get("date"),
-            "last_updated": dt_util.now().isoformat(),
+            "entries": self._day_data.get("events", []),
+            "date": self._day_data.get("date"),
+            "last_updated": self._last_updated,
+        }
+
+
+class DailyActivityFeedStatsSensor(CoordinatorEntity, SensorEntity):
+    """Number of events of a day, broken down by type, priority and hour.
+
+    The add-on keeps these counts up to date, so templates can read them
+    from a few small attributes instead of iterating the entries.
+    """
+
+    def __init__(
+        self,
+        coordinator: DailyActivityFeedStatsCoordinator,
+        entry: ConfigEntry,
+        day: str,
+        name_suffix: str,
+    ) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        
+        self._day = day
+        self._attr_name = f"Daily Activity {name_suffix} Stats"
+        self._attr_unique_id = f"{entry.entry_id}_{day}_stats"
+        self._attr_icon = "mdi:chart-bar"
+
+    @property
+    def _day_data(self):
+        """Return this sensor's day from the coordinator data."""
+        if self.coordinator.data:
+            return self.coordinator.data.get(self._day)
+        return None
+
+    @property
+    def native_value(self):
+        """Return the state of the sensor."""
+        if self._day_data:
+            return self._day_data.get("count", 0)
+        return 0
+
+    @property
+    def extra_state_attributes(self):
+        """Return the state attributes."""
+        day_data = self._day_data or {}
+        return {
+            "date": day_data.get("date"),
+            "types": day_data.get("types", {}),
+            "priorities": day_data.get("priorities", {}),
+            "hours": day_data.get("hours", [0] * 24),
         }
+
+
+class DailyActivityFeedOutboxSensor(SensorEntity):
+    """Number of events and image updates waiting to be sent to the add-on."""
+
+    _attr_should_poll = False
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(
+        self,
+        outbox: DailyActivityFeedOutbox,
+        entry: ConfigEntry,
+        name_prefix: str,
+    ) -> None:
+        """Initialize the sensor."""
+        self._outbox = outbox
+        self._attr_name = f"Daily Activity {name_prefix}Outbox"
+        self._attr_unique_id = f"{entry.entry_id}_outbox"
+        self._attr_icon = "mdi:tray-arrow-up"
+
+    async def async_added_to_hass(self) -> None:
+        """Update whenever the outbox changes."""
+        self.async_on_remove(self._outbox.async_add_listener(self.async_write_ha_state))
+
+    @property
+    def native_value(self):
+        """Return the number of queued changes."""
+        return len(self._outbox)
+
+    @property
+    def extra_state_attributes(self):
+        """Return the state of the sender."""
+        return self._outbox.status()
@@ -0,0 +1,333 @@
+"""Camera snapshots and thumbnails for the Daily Activity Feed"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any
+
+from aiohttp import web
+from PIL import Image, ImageOps
+
+from homeassistant.components.camera import async_get_image
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.core import HomeAssistant
+
+from .const import (
+    DEFAULT_SNAPSHOT_MAX_MB,
+    PENDING_SNAPSHOT_TIMEOUT,
+    SNAPSHOT_CACHE_CONTROL,
+    SNAPSHOT_URL,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_SIZE,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Names handed out by SnapshotManager (content hashes); nothing else is served
+_NAME = re.compile(r"^[0-9a-f]{24}(_thumb)?\.[a-z0-9]+$")
+
+# Finished captures remembered for pending URLs that are requested late
+_RESOLVED_SIZE = 256
+
+# Snapshots written by earlier versions straight into /config/www
+_LEGACY_PATTERN = "daf_*.jpg"
+
+
+class SnapshotManager:
+    """Keep camera snapshots and their thumbnails within a disk budget.
+
+    Every snapshot is named after a hash of its content and written once
+    together with a downscaled thumbnail, so names never collide and both
+    files can be cached by browsers forever.
+    Files not taken again within the retention window are removed daily
+    (taking the same picture again renews their modification time), and
+    when the directory grows beyond its budget the least recently served
+    files are evicted first.
+
+    All config entries share the directory, so the largest budget and
+    the longest retention of their add-ons apply. Nothing is pruned
+    until every entry's add-on has told how long it keeps events.
+    """
+
+    def __init__(self, hass: HomeAssistant, directory: Path) -> None:
+        """Initialize."""
+        self.hass = hass
+        self.directory = directory
+        self.max_bytes = DEFAULT_SNAPSHOT_MAX_MB * 1024 * 1024
+        self.retention_days: int | None = None
+        # Config entry id -> (budget in MB, add-on retention in days or None)
+        self._entries: dict[str, tuple[int, int | None]] = {}
+        # File name -> size, least recently used first
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        # Captures still running or recently finished, keyed by event id
+        self._pending: dict[str, asyncio.Task] = {}
+        self._resolved: OrderedDict[str, tuple[str, str | None] | None] = OrderedDict()
+
+    def configure(self, entry_id: str, max_mb: int) -> None:
+        """Apply the budget of a config entry."""
+        _, retention_days = self._entries.get(entry_id, (max_mb, None))
+        self._entries[entry_id] = (max_mb, retention_days)
+        self._apply_limits()
+
+    def set_retention(self, entry_id: str, retention_days: int) -> None:
+        """Keep snapshots as long as a config entry's add-on keeps events."""
+        max_mb, _ = self._entries.get(entry_id, (DEFAULT_SNAPSHOT_MAX_MB, None))
+        self._entries[entry_id] = (max_mb, retention_days)
+        self._apply_limits()
+
+    def remove(self, entry_id: str) -> None:
+        """Forget the limits of an unloaded config entry."""
+        self._entries.pop(entry_id, None)
+        self._apply_limits()
+
+    def _apply_limits(self) -> None:
+        """Use the largest budget and longest retention of the config entries."""
+        limits = self._entries.values()
+        max_mb = max((max_mb for max_mb, _ in limits), default=DEFAULT_SNAPSHOT_MAX_MB)
+        self.max_bytes = max_mb * 1024 * 1024
+        retentions = [retention_days for _, retention_days in limits]
+        self.retention_days = None if not retentions or None in retentions else max(retentions)
+
+    def url(self, name: str) -> str:
+        """Return the URL a snapshot file is served at."""
+        return f"{SNAPSHOT_URL}/{name}"
+
+    def path(self, name: str) -> Path | None:
+        """Return the path of a known snapshot file and mark it as used."""
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        return self.directory / name
+
+    def load(self) -> None:
+        """Index the snapshot directory, oldest access first (runs in the executor)."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.directory.iterdir():
+            if not _NAME.match(path.name):
+                continue
+            stat = path.stat()
+            entries.append((max(stat.st_atime, stat.st_mtime), path.name, stat.st_size))
+
+        with self._lock:
+            self._files.clear()
+            for _, name, size in sorted(entries):
+                self._files[name] = size
+            self._total = sum(self._files.values())
+        _LOGGER.debug(
+            "Indexed %s snapshot files (%s bytes)", len(self._files), self._total
+        )
+
+    def pending_url(self, event_id: str) -> str:
+        """Return the URL that stands in for a snapshot until it is taken."""
+        return f"{SNAPSHOT_URL}/pending/{event_id}"
+
+    def async_start_capture(self, camera_entity: str, event_id: str) -> asyncio.Task:
+        """Start taking a snapshot for an event without waiting for it."""
+        task = self.hass.async_create_task(self.async_capture(camera_entity))
+        self._pending[event_id] = task
+
+        def _resolved(task: asyncio.Task) -> None:
+            self._pending.pop(event_id, None)
+            failed = task.cancelled() or task.exception() is not None
+            self._resolved[event_id] = None if failed else task.result()
+            if len(self._resolved) > _RESOLVED_SIZE:
+                self._resolved.popitem(last=False)
+
+        task.add_done_callback(_resolved)
+        return task
+
+    async def async_resolve(self, event_id: str) -> tuple[str, str | None] | None:
+        """Wait for the snapshot of an event and return its URLs (None if it failed)."""
+        task = self._pending.get(event_id)
+        if task is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), PENDING_SNAPSHOT_TIMEOUT)
+            except Exception:  # pylint: disable=broad-except
+                return None
+        return self._resolved.get(event_id)
+
+    async def async_capture(self, camera_entity: str) -> tuple[str, str | None]:
+        """Take a snapshot and return the URLs of the image and its thumbnail."""
+        image = await async_get_image(self.hass, camera_entity)
+        extension = mimetypes.guess_extension(image.content_type) or ".jpg"
+        return await self.hass.async_add_executor_job(self._save, extension, image.content)
+
+    def _save(self, extension: str, content: bytes) -> tuple[str, str | None]:
+        """Write a snapshot and its thumbnail unless they exist, then enforce the budget."""
+        name = hashlib.sha256(content).hexdigest()[:24]
+        image_name = f"{name}{extension}"
+        thumbnail_name: str | None = f"{name}_thumb.jpg"
+
+        reused = False
+        with self._lock:
+            if image_name in self._files:
+                # Same picture as before (e.g. a still camera): reuse it
+                self._files.move_to_end(image_name)
+                if thumbnail_name in self._files:
+                    self._files.move_to_end(thumbnail_name)
+                    reused = True
+        if reused:
+            try:
+                # Pruning goes by modification time, so renew it for the new event
+                os.utime(self.directory / image_name)
+                os.utime(self.directory / thumbnail_name)
+                return self.url(image_name), self.url(thumbnail_name)
+            except FileNotFoundError:
+                pass
+
+        written = {}
+        try:
+            os.utime(self.directory / image_name)
+        except FileNotFoundError:
+            (self.directory / image_name).write_bytes(content)
+        written[image_name] = len(content)
+
+        try:
+            thumbnail = _make_thumbnail(content)
+            (self.directory / thumbnail_name).write_bytes(thumbnail)
+            written[thumbnail_name] = len(thumbnail)
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.warning("Could not create thumbnail for %s: %s", image_name, err)
+            thumbnail_name = None
+
+        with self._lock:
+            for written_name, size in written.items():
+                self._total += size - self._files.get(written_name, 0)
+                self._files[written_name] = size
+                self._files.move_to_end(written_name)
+            evicted = self._evict(keep=len(written))
+        if evicted:
+            _LOGGER.info(
+                "Removed %s snapshot file(s) to stay within %s MB",
+                evicted,
+                self.max_bytes // (1024 * 1024),
+            )
+
+        return (
+            self.url(image_name),
+            self.url(thumbnail_name) if thumbnail_name else None,
+        )
+
+    def _evict(self, keep: int) -> int:
+        """Delete least recently used files until the budget is met (lock held)."""
+        evicted = 0
+        while self._total > self.max_bytes and len(self._files) > keep:
+            name, size = self._files.popitem(last=False)
+            self._total -= size
+            (self.directory / name).unlink(missing_ok=True)
+            evicted += 1
+        return evicted
+
+    async def async_prune(self, now: datetime | None = None) -> None:
+        """Remove snapshots older than the retention window."""
+        if self.retention_days is None:
+            _LOGGER.debug("Not pruning snapshots until the add-on's retention is known")
+            return
+        removed = await self.hass.async_add_executor_job(self._prune)
+        if removed:
+            _LOGGER.info(
+                "Removed %s snapshot file(s) older than %s days",
+                removed,
+                self.retention_days,
+            )
+
+    def _prune(self) -> int:
+        """Delete expired snapshots, including ones from earlier versions."""
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+
+        with self._lock:
+            for name in list(self._files):
+                path = self.directory / name
+                try:
+                    expired = path.stat().st_mtime < cutoff
+                except FileNotFoundError:
+                    expired = True
+                if expired:
+                    self._total -= self._files.pop(name)
+                    path.unlink(missing_ok=True)
+                    removed += 1
+
+        for path in Path(self.hass.config.path("www")).glob(_LEGACY_PATTERN):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def stats(self) -> dict[str, Any]:
+        """Return disk usage statistics."""
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "retention_days": self.retention_days,
+            }
+
+
+class SnapshotView(HomeAssistantView):
+    """Serve snapshots with long-lived cache headers.
+
+    Snapshot names are unique and random, so like /local files they are
+    served without authentication and can be embedded in cards.
+    """
+
+    url = f"{SNAPSHOT_URL}/{{name}}"
+    name = "api:daily_activity_feed:snapshot"
+    requires_auth = False
+
+    def __init__(self, snapshots: SnapshotManager) -> None:
+        """Initialize."""
+        self.snapshots = snapshots
+
+    async def get(self, request: web.Request, name: str) -> web.StreamResponse:
+        """Return a snapshot file."""
+        path = self.snapshots.path(name) if _NAME.match(name) else None
+        if path is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        return web.FileResponse(path, headers={"Cache-Control": SNAPSHOT_CACHE_CONTROL})
+
+
+class PendingSnapshotView(HomeAssistantView):
+    """Redirect the stand-in URL of a snapshot to the file once it is taken."""
+
+    url = f"{SNAPSHOT_URL}/pending/{{event_id}}"
+    name = "api:daily_activity_feed:pending_snapshot"
+    requires_auth = False
+
+    def __init__(self, snapshots: SnapshotManager) -> None:
+        """Initialize."""
+        self.snapshots = snapshots
+
+    async def get(self, request: web.Request, event_id: str) -> web.StreamResponse:
+        """Wait for the snapshot and redirect to it."""
+        urls = await self.snapshots.async_resolve(event_id)
+        if urls is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        raise web.HTTPTemporaryRedirect(urls[0], headers={"Cache-Control": "no-store"})
+
+
+def _make_thumbnail(content: bytes) -> bytes:
+    """Downscale an image to a JPEG thumbnail."""
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(THUMBNAIL_SIZE)
+        output = io.BytesIO()
+        image.convert("RGB").save(output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        return output.getvalue()
+
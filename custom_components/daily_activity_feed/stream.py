@@ -0,0 +1,148 @@
+"""Push updates from the Daily Activity Feed add-on"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, Any
+
+import aiohttp
+
+from homeassistant.util.json import json_loads
+
+from .api import DailyActivityFeedApiClient
+from .const import (
+    SENSOR_TODAY,
+    SENSOR_YESTERDAY,
+    STREAM_READ_TIMEOUT,
+    STREAM_RECONNECT_MAX,
+)
+
+if TYPE_CHECKING:
+    from .sensor import DailyActivityFeedDataUpdateCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DailyActivityFeedStream:
+    """Keep one long-lived connection to the add-on's event stream.
+
+    While the stream is connected the coordinator stops polling and is
+    updated from the pushed changes. When it drops, polling resumes until
+    the stream can be re-established.
+    """
+
+    def __init__(
+        self,
+        client: DailyActivityFeedApiClient,
+        coordinator: DailyActivityFeedDataUpdateCoordinator,
+    ) -> None:
+        """Initialize."""
+        self.client = client
+        self.coordinator = coordinator
+        self._update_interval = coordinator.update_interval
+
+    async def async_run(self) -> None:
+        """Connect to the stream and reconnect with backoff until cancelled."""
+        backoff = 1
+        while True:
+            try:
+                await self._async_listen()
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                _LOGGER.debug("Event stream unavailable: %s", err)
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.warning("Event stream failed: %s", err)
+
+            await self._async_resume_polling()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, STREAM_RECONNECT_MAX)
+
+    async def _async_listen(self) -> None:
+        """Read server-sent events until the connection closes."""
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=STREAM_READ_TIMEOUT)
+
+        async with self.client.session.get(
+            self.client.url("/api/stream"),
+            params=self.coordinator.params,
+            timeout=timeout,
+        ) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info,
+                    response.history,
+                    status=response.status,
+                )
+
+            kind: str | None = None
+            data: list[str] = []
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    kind = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and kind:
+                    self._handle(kind, json_loads("\n".join(data)))
+                    kind = None
+                    data = []
+
+    def _handle(self, kind: str, data: dict[str, Any]) -> None:
+        """Apply one pushed change to the coordinator."""
+        coordinator = self.coordinator
+
+        if kind == "snapshot":
+            # Connected: the stream now carries every change, stop polling
+            coordinator.update_interval = None
+            coordinator.async_set_updated_data(data)
+            _LOGGER.debug("Event stream connected")
+            return
+
+        current = coordinator.data or {}
+
+        if kind == "insert":
+            day = current.get(data["day"], {})
+            # The add-on already applied the type/priority/field filters
+            limit = data["count"]
+            if "limit" in coordinator.params:
+                limit = min(limit, int(coordinator.params["limit"]))
+            events = [data["event"], *day.get("events", [])][:limit]
+            coordinator.async_set_updated_data(
+                {**current, data["day"]: {**day, "count": data["count"], "events": events}}
+            )
+
+        elif kind == "update":
+            day = current.get(data["day"], {})
+            seq = data["event"]["seq"]
+            events = [
+                data["event"] if event.get("seq") == seq else event
+                for event in day.get("events", [])
+            ]
+            coordinator.async_set_updated_data({**current, data["day"]: {**day, "events": events}})
+
+        elif kind == "clear":
+            day = current.get(data["day"], {})
+            coordinator.async_set_updated_data(
+                {**current, data["day"]: {**day, "count": 0, "events": []}}
+            )
+
+        elif kind == "rollover":
+            new_date = date.fromisoformat(data["date"])
+            yesterday_date = (new_date - timedelta(days=1)).isoformat()
+            previous = current.get(SENSOR_TODAY, {})
+            if previous.get("date") != yesterday_date:
+                previous = {"date": yesterday_date, "count": 0, "events": []}
+            coordinator.async_set_updated_data(
+                {
+                    SENSOR_TODAY: {"date": new_date.isoformat(), "count": 0, "events": []},
+                    SENSOR_YESTERDAY: previous,
+                }
+            )
+
+    async def _async_resume_polling(self) -> None:
+        """Fall back to interval polling while the stream is down."""
+        if self.coordinator.update_interval is None:
+            self.coordinator.update_interval = self._update_interval
+            await self.coordinator.async_request_refresh()
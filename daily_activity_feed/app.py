@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
-import json
+import asyncio
+import gzip
+import inspect
 import os
+import re
+import signal
 import sys
+import tempfile
+import uuid
 import warnings
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from functools import partial
 from pathlib import Path
-from typing import Optional, List
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 import uvicorn
 import logging
 
+import codec
+import metrics
+from replication import Primary, RemoteError, Replica, ReplicaStore
+from store import DAYS, WRITE_METRICS, DayEvents, EventStore, Record
+
 # Suppress deprecation warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -27,191 +42,1057 @@ uvicorn_access = logging.getLogger("uvicorn.access")
 uvicorn_access.setLevel(logging.WARNING)
 
 # Configuration
-DATA_DIR = Path("/data")
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
 DB_FILE = DATA_DIR / "events.json"
 PORT = int(os.getenv("PORT", 8099))
 MAX_EVENTS = int(os.getenv("MAX_EVENTS", 100))
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 7))
+DURABILITY = os.getenv("DURABILITY", "fsync")
+FLUSH_INTERVAL = int(os.getenv("FLUSH_INTERVAL_MS", 100)) / 1000
+WORKERS = int(os.getenv("WORKERS", 1))
+# Named feeds besides the default one, as a JSON list of
+# {"name", "max_events_per_day", "retention_days"} (limits are optional)
+FEEDS = codec.loads(os.getenv("FEEDS") or "[]")
+FEEDS_DIR = DATA_DIR / "feeds"
+DEFAULT_FEED = "default"
+FEED_NAME = re.compile(r"[a-z0-9_-]{1,32}")
+# Set by the primary for the worker processes it starts: the directory
+# holding one socket per feed
+PRIMARY_SOCKETS = os.getenv("PRIMARY_SOCKETS")
 
 # Ensure data directory exists
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+HTTP_REQUESTS = metrics.Counter(
+    "daily_activity_feed_http_requests_total",
+    "HTTP requests by method, route and status",
+    ("method", "route", "status")
+)
+HTTP_LATENCY = metrics.Histogram(
+    "daily_activity_feed_http_request_seconds",
+    "Time until the response starts, by method and route",
+    ("method", "route")
+)
+HTTP_SIZES = metrics.Histogram(
+    "daily_activity_feed_http_response_bytes",
+    "Size of JSON response bodies by route",
+    ("route",),
+    metrics.SIZE_BUCKETS
+)
+# Recorded by the workers and summed up by the primary
+HTTP_METRICS = (HTTP_REQUESTS, HTTP_LATENCY, HTTP_SIZES)
+
 app = FastAPI(title="Daily Activity Feed API")
+app.add_middleware(
+    metrics.MetricsMiddleware, requests=HTTP_REQUESTS, latency=HTTP_LATENCY, sizes=HTTP_SIZES
+)
+# Routes shared by the default feed (under /api) and the named feeds
+# (under /api/feeds/{feed})
+api = APIRouter()
+rollover_task: Optional[asyncio.Task] = None
+metrics_task: Optional[asyncio.Task] = None
+
+# How long a worker waits for a change another worker already reported
+CATCH_UP_TIMEOUT = 0.5
+
+# How often a worker hands the requests it served to the primary (seconds)
+METRICS_INTERVAL = 5
+
+# Pre-encoded responses are validated by their ETag. The instance id keeps
+# ETags from a previous run from matching; workers share the primary's, so
+# any of them can validate an ETag.
+INSTANCE_ID = os.getenv("INSTANCE_ID") or uuid.uuid4().hex[:8]
+RESPONSE_CACHE_SIZE = 64
+
+# Compact alternative to application/json, chosen with the Accept header:
+# every day lists its field names once and each event as an array of values
+COLUMNS_MEDIA_TYPE = "application/vnd.daily-activity-feed.columns+json"
+
+# Feed bodies from this size on are sent gzip-compressed if the client accepts it
+GZIP_MIN_SIZE = 8192
+GZIP_LEVEL = 5
+
+# Search results per page
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 200
 
 
 class Event(BaseModel):
+    id: Optional[str] = Field(None, max_length=64)
     type: str
     title: str
     text: str
     image: Optional[str] = None
+    thumbnail: Optional[str] = None
+    priority: str = "normal"
+    occurred_at: Optional[datetime] = None
+
+
+class EventUpdate(BaseModel):
+    image: Optional[str] = None
+    thumbnail: Optional[str] = None
+
+
+def split_list(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Split a comma-separated query parameter"""
+    if not value:
+        return None
+    return tuple(item.strip() for item in value.split(",") if item.strip()) or None
+
+
+@dataclass(frozen=True)
+class EventQuery:
+    """Filters, paging and projection requested for a feed read"""
+    types: Optional[Tuple[str, ...]] = None
+    priorities: Optional[Tuple[str, ...]] = None
+    after: Optional[int] = None
+    before: Optional[int] = None
+    limit: Optional[int] = None
+    fields: Optional[Tuple[str, ...]] = None
+
+    def filters(self) -> dict:
+        """Keyword arguments for EventStore.query"""
+        return {
+            "types": self.types,
+            "priorities": self.priorities,
+            "after": self.after,
+            "before": self.before,
+            "limit": self.limit,
+        }
+
+    def matches(self, event: Record) -> bool:
+        """Check a single event against the type and priority filters"""
+        if self.types and event.type not in self.types:
+            return False
+        if self.priorities and event.priority not in self.priorities:
+            return False
+        return True
+
+    def project(self, event: Record) -> dict:
+        """Turn an event into its JSON form, reduced to the requested fields (seq is always kept)"""
+        if not self.fields:
+            return event.to_dict()
+        return event.to_dict(("seq", *self.fields))
 
 
-class StoredEvent(Event):
-    timestamp: str
-    date: str
+# Declared async, so FastAPI runs it on the event loop rather than
+# handing every read to its thread pool
+async def event_query(
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of events per day"),
+    cursor: Optional[int] = Query(None, description="Only events older than this seq (next page)"),
+    since: Optional[int] = Query(None, description="Only events newer than this seq"),
+    type: Optional[str] = Query(None, description="Comma-separated event types"),
+    priority: Optional[str] = Query(None, description="Comma-separated priorities"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+) -> EventQuery:
+    """Parse the shared query parameters of the read endpoints"""
+    return EventQuery(
+        types=split_list(type),
+        priorities=split_list(priority),
+        after=since,
+        before=cursor,
+        limit=limit,
+        fields=split_list(fields),
+    )
+
+
+# Server-sent event subscribers are kept per feed
+STREAM_QUEUE_SIZE = 100
+STREAM_KEEPALIVE = 25
+
+
+class Feed:
+    """A named feed: its store, and the responses and streams served from it.
+
+    Every feed has its own files, limits, lock and writer, so a write to
+    one never waits on or rewrites another.
+    """
+
+    def __init__(self, name: str, path: Path, max_events: int, retention_days: int) -> None:
+        self.name = name
+        # A worker process holds a replica of the primary's store
+        self.store = (ReplicaStore if PRIMARY_SOCKETS else EventStore)(
+            path,
+            max_events,
+            retention_days,
+            durability=DURABILITY,
+            flush_interval=FLUSH_INTERVAL
+        )
+        self.replica = None
+        if PRIMARY_SOCKETS:
+            self.replica = Replica(self.store, self.socket_path(Path(PRIMARY_SOCKETS)))
+        # Every change goes through this lock, so concurrent requests are
+        # applied one after the other. Nothing awaits while holding it
+        # (disk writes are queued for the writer), so it is effectively
+        # free; sync=true requests wait for their commit after releasing it.
+        self.write_lock = asyncio.Lock()
+        # Pre-encoded responses, keyed by day and query
+        self.response_cache: "OrderedDict[str, Encoded]" = OrderedDict()
+        # One bounded queue and query per stream connection
+        self.stream_queues: Dict[asyncio.Queue, EventQuery] = {}
+        self.store.add_listener(partial(publish_change, self))
+
+    def socket_path(self, directory: Path) -> Path:
+        """Return the socket the primary serves this feed's store on"""
+        return directory / f"{self.name}.sock"
+
+
+# Filled in once the functions the feeds refer to are defined
+feeds: Dict[str, Feed] = {}
+
+
+async def get_feed(request: Request) -> Feed:
+    """Return the feed named in the path, or the default feed"""
+    name = request.path_params.get("feed", DEFAULT_FEED)
+    feed = feeds.get(name)
+    if feed is None:
+        raise HTTPException(status_code=404, detail=f"No feed named {name}")
+    return feed
+
+
+metrics.Gauge(
+    "daily_activity_feed_events",
+    "Events stored for today and yesterday, by feed",
+    ("feed", "day"),
+    collect=lambda: {(feed.name, day): feed.store.count(day) for feed in feeds.values() for day in DAYS}
+)
+metrics.Gauge(
+    "daily_activity_feed_stream_subscribers",
+    "Open event streams by feed",
+    ("feed",),
+    collect=lambda: {(feed.name,): len(feed.stream_queues) for feed in feeds.values()}
+)
+
+
+def stamp_event(event: dict, now: datetime) -> Record:
+    """Turn an incoming event (as a dict) into a stored record.
+
+    It is dated with its occurred_at in local time, capped at now, or
+    with now if it has none.
+    """
+    if event.get("occurred_at"):
+        occurred_at = datetime.fromisoformat(event["occurred_at"])
+        if occurred_at.tzinfo is not None:
+            occurred_at = occurred_at.astimezone().replace(tzinfo=None)
+        now = min(occurred_at, now)
+    return Record(
+        event["type"],
+        event["title"],
+        event["text"],
+        image=event["image"],
+        thumbnail=event["thumbnail"],
+        priority=event["priority"],
+        timestamp=now.strftime("%H:%M:%S"),
+        date=now.strftime("%Y-%m-%d"),
+        id=event["id"]
+    )
+
 
+async def apply_change(feed: Feed, op: str, args: dict):
+    """Make a change to a feed and return its result in JSON form.
 
-def load_events() -> dict:
-    """Load events from JSON file"""
-    if not DB_FILE.exists():
-        return {"today": [], "yesterday": []}
+    A worker process forwards the change to the primary, which owns the
+    store and runs it through here.
+    """
+    if feed.replica is not None:
+        try:
+            return await feed.replica.request(op, args)
+        except RemoteError as e:
+            raise HTTPException(status_code=e.status, detail=e.detail)
     
+    store = feed.store
+    if op == "add":
+        now = datetime.now()
+        records = [stamp_event(event, now) for event in args["events"]]
+    async with feed.write_lock:
+        store.ensure_current()
+        if op == "add":
+            # Older days the events are dated are read off the event loop
+            partitions = await store.load_partitions(
+                {date.fromisoformat(record.date) for record in records if record.id is not None}
+            )
+            # An event resent with an id that is already stored (a client
+            # retrying after losing the response) is answered, not added twice
+            stored_events, new_events = [], []
+            for event, record in zip(args["events"], records):
+                day_date = date.fromisoformat(record.date)
+                if day_date < store.oldest_date:
+                    raise HTTPException(
+                        status_code=422,
+                        detail=f"occurred_at {event['occurred_at']} is outside the {store.retention_days} day retention"
+                    )
+                stored = None
+                if record.id is not None:
+                    stored = store.get(record.id) or partitions[day_date].get(record.id)
+                if stored is None:
+                    stored = record
+                    new_events.append(stored)
+                stored_events.append(stored)
+            store.add_many(new_events)
+            result = [event.to_dict() for event in stored_events]
+        elif op == "update":
+            event = store.update(args["id"], args["changes"])
+            result = None if event is None else event.to_dict()
+        elif op == "clear":
+            day_date = resolve_day(feed, args["day"])
+            await store.load_partitions([day_date])
+            result = store.clear_date(day_date)
+        else:
+            raise ValueError(f"Unknown change {op!r}")
+    if args.get("sync"):
+        await store.commit()
+    return result
+
+
+async def answer_worker(feed: Feed, op: str, args: dict):
+    """Run a request a worker process forwarded to the primary"""
+    if op in ("metrics", "http_metrics"):
+        # Workers hand over the requests they served, so the totals span all of them
+        metrics.merge(HTTP_METRICS, args.get("http", {}))
+        return metrics.render(only=WRITE_METRICS + HTTP_METRICS) if op == "metrics" else None
+    return await apply_change(feed, op, args)
+
+
+async def report_metrics(replica: Replica, op: str = "http_metrics"):
+    """Hand this worker's request metrics to the primary and return its answer"""
+    http = metrics.take(HTTP_METRICS)
     try:
-        with open(DB_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading events: {e}")
-        return {"today": [], "yesterday": []}
+        return await replica.request(op, {"http": http})
+    except RemoteError:
+        # Counted again with the next report
+        metrics.merge(HTTP_METRICS, http)
+        raise
+
+
+async def metrics_reporter(replica: Replica) -> None:
+    """Hand this worker's request metrics to the primary every METRICS_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        try:
+            await report_metrics(replica)
+        except RemoteError:
+            pass
+
+
+class FeedResponse(Response):
+    """JSON response encoded with the codec, skipping FastAPI's jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return codec.dumps(content)
+
+
+class Encoded:
+    """An encoded feed body and its ETag; the gzip variant is made on first use"""
+    __slots__ = ("etag", "body", "media_type", "_gzipped")
+
+    def __init__(self, etag: str, body: bytes, media_type: str) -> None:
+        self.etag = etag
+        self.body = body
+        self.media_type = media_type
+        self._gzipped: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, GZIP_LEVEL, mtime=0)
+        return self._gzipped
+
+
+def to_columns(payload):
+    """Rewrite every list of events in a payload to one field list plus an array of values per event"""
+    if isinstance(payload, list):
+        return [to_columns(item) for item in payload]
+    if not isinstance(payload, dict):
+        return payload
+    if "events" in payload:
+        # All events of a list are projected to the same fields, in the same order
+        events = payload["events"]
+        return {
+            **payload,
+            "fields": list(events[0]) if events else [],
+            "events": [list(event.values()) for event in events]
+        }
+    return {key: to_columns(value) for key, value in payload.items()}
+
+
+def wants_columns(request: Request) -> bool:
+    """Check whether the client asked for the columns format"""
+    return COLUMNS_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def accepts_gzip(request: Request) -> bool:
+    """Check the Accept-Encoding header for gzip (not disabled with q=0)"""
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.strip().removeprefix("q=")
+            try:
+                return not params or float(q) > 0
+            except ValueError:
+                return True
+    return False
+
 
+def feed_etag(request: Request, version: str) -> str:
+    """Return the ETag of a feed version in the format the client asked for"""
+    if wants_columns(request):
+        version = f"{version}-columns"
+    return f'"{INSTANCE_ID}-{version}"'
 
-def save_events(data: dict) -> None:
-    """Save events to JSON file"""
+
+def encode_payload(request: Request, etag: str, payload: dict) -> Encoded:
+    """Encode a feed payload in the format the client asked for"""
+    if wants_columns(request):
+        return Encoded(etag, codec.dumps(to_columns(payload)), COLUMNS_MEDIA_TYPE)
+    return Encoded(etag, codec.dumps(payload), "application/json")
+
+
+def day_payload(day_events: DayEvents, day_date: date, query: EventQuery = EventQuery()) -> dict:
+    """Build the response payload for one day.
+
+    ``count`` is the number of matching events; ``next_cursor`` is set
+    when ``limit`` cut the page short.
+    """
+    count, events = day_events.query(**query.filters())
+    payload = {
+        "date": day_date.strftime("%Y-%m-%d"),
+        "count": count,
+        "events": [query.project(event) for event in events]
+    }
+    if query.limit is not None and count > len(events):
+        payload["next_cursor"] = events[-1].seq
+    return payload
+
+
+def delta_payload(store: EventStore, since_seq: int, query: EventQuery) -> dict:
+    """Build the changes to today and yesterday after a sequence id.
+
+    Each day holds the new and updated events that match the query and
+    its current ``count``; ``tombstones`` lists clears and rollovers in
+    order. If the journal no longer reaches back to since_seq, both days
+    are sent in full with ``full`` set.
+    """
+    changes = store.changes_since(since_seq)
+    payload = {
+        "instance": INSTANCE_ID,
+        "seq": store.last_seq,
+        "full": changes is None,
+        "tombstones": [] if changes is None else changes[0]
+    }
+    for day in DAYS:
+        day_date = store.day_date(day)
+        if changes is None:
+            payload[day] = day_payload(store.partition(day_date), day_date, query)
+            continue
+        count, _ = store.query(day, types=query.types, priorities=query.priorities, limit=0)
+        _, events = store.query(
+            day, types=query.types, priorities=query.priorities, after=since_seq, limit=query.limit
+        )
+        events += [event for event in changes[1][day] if query.matches(event)]
+        payload[day] = {
+            "date": day_date.strftime("%Y-%m-%d"),
+            "count": count,
+            "events": [query.project(event) for event in events]
+        }
+    return payload
+
+
+async def cached_body(
+    feed: Feed, request: Request, key: str, version: str, build: Callable[[], Union[dict, Awaitable[dict]]]
+) -> Encoded:
+    """Return the encoded body for a response of a feed, re-encoding only on change.
+
+    build may be a coroutine function, for payloads that read older days.
+    """
+    etag = feed_etag(request, version)
+    if wants_columns(request):
+        key = f"columns:{key}"
+    response_cache = feed.response_cache
+    cached = response_cache.get(key)
+    if cached is None or cached.etag != etag:
+        payload = build()
+        if inspect.isawaitable(payload):
+            payload = await payload
+        cached = encode_payload(request, etag, payload)
+        response_cache[key] = cached
+        if len(response_cache) > RESPONSE_CACHE_SIZE:
+            response_cache.popitem(last=False)
+    else:
+        response_cache.move_to_end(key)
+    return cached
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check the request's If-None-Match header against an ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def cached_response(request: Request, encoded: Encoded) -> Response:
+    """Serve an encoded body, gzipped if it is large, or 304 if the client copy is current"""
+    etag = encoded.etag
+    body = encoded.body
+    compress = len(body) >= GZIP_MIN_SIZE and accepts_gzip(request)
+    if compress:
+        # Each encoding of a body needs its own strong ETag
+        etag = f'{etag[:-1]}-gzip"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+        body = encoded.gzipped()
+    return Response(content=body, media_type=encoded.media_type, headers=headers)
+
+
+def resolve_day(feed: Feed, day: str) -> date:
+    """Turn "today", "yesterday" or an ISO date into a retained date of a feed"""
+    store = feed.store
+    if day in DAYS:
+        return store.day_date(day)
     try:
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving events: {e}")
-
-
-def cleanup_old_events() -> None:
-    """Remove events older than yesterday"""
-    data = load_events()
-    today = datetime.now().date()
-    yesterday = today - timedelta(days=1)
-    
-    today_str = today.strftime("%Y-%m-%d")
-    yesterday_str = yesterday.strftime("%Y-%m-%d")
-    
-    # Move today to yesterday if date changed
-    if data.get("today") and len(data["today"]) > 0:
-        first_event_date = data["today"][0].get("date", today_str)
-        if first_event_date != today_str:
-            logger.info(f"Date changed - moved {len(data['today'])} events to yesterday")
-            data["yesterday"] = data["today"]
-            data["today"] = []
-    
-    # Filter yesterday's events
-    if data.get("yesterday"):
-        old_count = len(data["yesterday"])
-        data["yesterday"] = [
-            event for event in data["yesterday"]
-            if event.get("date") == yesterday_str
-        ]
-        if old_count != len(data["yesterday"]):
-            removed = old_count - len(data["yesterday"])
-            logger.info(f"Cleaned up {removed} old event(s)")
-    
-    save_events(data)
+        day_date = date.fromisoformat(day)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Day must be 'today', 'yesterday' or YYYY-MM-DD")
+    if not store.oldest_date <= day_date <= store.current_date:
+        raise HTTPException(status_code=404, detail=f"{day} is outside the {store.retention_days} day retention")
+    return day_date
+
+
+def date_version(store: EventStore, day_date: date) -> str:
+    """Return the version of the partition holding a date"""
+    for day in DAYS:
+        if day_date == store.day_date(day):
+            return f"{day}-{store.version(day)}"
+    return f"history-{store.version('history')}"
+
+
+def sse_message(kind: str, data: dict) -> bytes:
+    """Format one server-sent event"""
+    return b"event: " + kind.encode("utf-8") + b"\ndata: " + codec.dumps(data) + b"\n\n"
+
+
+def event_message(store: EventStore, kind: str, query: EventQuery, data: dict) -> Optional[bytes]:
+    """Format an insert or update for one subscriber, or None if its filters exclude it"""
+    event = data["event"]
+    if not query.matches(event):
+        return None
+    message = {"day": data["day"], "event": query.project(event)}
+    if kind == "insert":
+        message["count"] = data["count"]
+        if query.types or query.priorities:
+            message["count"], _ = store.query(
+                data["day"], types=query.types, priorities=query.priorities, limit=0
+            )
+    return sse_message(kind, message)
+
+
+def publish_change(feed: Feed, kind: str, data: dict) -> None:
+    """Fan a change of a feed out to its stream subscribers"""
+    stream_queues = feed.stream_queues
+    if not stream_queues:
+        return
+    if kind in ("insert", "clear") and "day" not in data:
+        # Only today and yesterday are streamed
+        return
+    per_event = kind in ("insert", "update")
+    message = None if per_event else sse_message(kind, data)
+    for queue, query in list(stream_queues.items()):
+        subscriber_message = message
+        if per_event:
+            subscriber_message = event_message(feed.store, kind, query, data)
+            if subscriber_message is None:
+                continue
+        try:
+            queue.put_nowait(subscriber_message)
+        except asyncio.QueueFull:
+            # Subscriber fell behind - drop it so it reconnects and resyncs
+            stream_queues.pop(queue, None)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+feeds[DEFAULT_FEED] = Feed(DEFAULT_FEED, DB_FILE, MAX_EVENTS, RETENTION_DAYS)
+for options in FEEDS:
+    name = options.get("name", "")
+    if not FEED_NAME.fullmatch(name) or name in feeds:
+        logger.warning(f"Ignoring feed {name!r}: names must be unique and made of a-z, 0-9, _ and -")
+        continue
+    feeds[name] = Feed(
+        name,
+        FEEDS_DIR / name / "events.json",
+        options.get("max_events_per_day") or MAX_EVENTS,
+        options.get("retention_days") or RETENTION_DAYS
+    )
+
+
+async def stream_messages(feed: Feed, queue: asyncio.Queue, query: EventQuery) -> AsyncIterator[bytes]:
+    """Yield a snapshot followed by every change until the client goes away"""
+    store = feed.store
+    try:
+        store.ensure_current()
+        snapshot = {}
+        for day in DAYS:
+            day_date = store.day_date(day)
+            snapshot[day] = day_payload(store.partition(day_date), day_date, query)
+        yield sse_message("snapshot", snapshot)
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                message = b": keepalive\n\n"
+            if message is None:
+                break
+            yield message
+    finally:
+        feed.stream_queues.pop(queue, None)
+
+
+async def rollover_scheduler() -> None:
+    """Roll every feed over shortly after every local midnight"""
+    while True:
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), time.min)
+        await asyncio.sleep((midnight - now).total_seconds() + 1)
+        for feed in feeds.values():
+            async with feed.write_lock:
+                feed.store.ensure_current()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Run cleanup on startup"""
+    """Load the feeds and start the rollover scheduler on startup"""
+    global rollover_task, metrics_task
+    if PRIMARY_SOCKETS:
+        for feed in feeds.values():
+            await feed.replica.start()
+        metrics_task = asyncio.create_task(metrics_reporter(feeds[DEFAULT_FEED].replica))
+        return
+    
     logger.info("=========================================")
     logger.info("Daily Activity Feed API")
     logger.info("=========================================")
     logger.info(f"Port: {PORT}")
     logger.info(f"Max events/day: {MAX_EVENTS}")
+    logger.info(f"Retention: {RETENTION_DAYS} days")
+    logger.info(f"Durability: {DURABILITY}, flushed every {int(FLUSH_INTERVAL * 1000)} ms")
     logger.info(f"Data: {DB_FILE}")
-    cleanup_old_events()
-    data = load_events()
-    logger.info(f"Loaded: {len(data.get('today', []))} today, {len(data.get('yesterday', []))} yesterday")
+    logger.info(f"JSON: {codec.BACKEND}")
+    logger.info(f"Workers: {WORKERS}")
+    for feed in feeds.values():
+        store = feed.store
+        store.load()
+        store.ensure_current()
+        store.start_writer()
+        loaded = f"{store.count('today')} today, {store.count('yesterday')} yesterday"
+        if feed.name == DEFAULT_FEED:
+            logger.info(f"Loaded: {loaded}")
+        else:
+            logger.info(
+                f"Loaded feed {feed.name}: {loaded} "
+                f"(max {store.max_events}/day, {store.retention_days} days)"
+            )
+    rollover_task = asyncio.create_task(rollover_scheduler())
     logger.info("Ready to accept events")
     logger.info("=========================================")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the rollover scheduler and write a final snapshot of every feed on shutdown"""
+    if PRIMARY_SOCKETS:
+        if metrics_task is not None:
+            metrics_task.cancel()
+        for feed in feeds.values():
+            await feed.replica.close()
+        return
+    if rollover_task is not None:
+        rollover_task.cancel()
+    for feed in feeds.values():
+        await feed.store.close()
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
-    return {
+    return FeedResponse({
         "status": "ok",
         "service": "Daily Activity Feed API",
         "version": "1.0.0",
-        "port": PORT
-    }
+        "port": PORT,
+        "feeds": list(feeds)
+    })
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request, storage and feed metrics in the Prometheus text format"""
+    replica = feeds[DEFAULT_FEED].replica
+    if replica is not None:
+        # This worker's feeds, plus the primary's disk writes and the
+        # requests of all workers
+        content = metrics.render(exclude=WRITE_METRICS + HTTP_METRICS)
+        try:
+            content += await report_metrics(replica, "metrics")
+        except RemoteError:
+            pass
+        return Response(content=content, media_type=metrics.CONTENT_TYPE)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/feeds")
+async def list_feeds():
+    """List the feeds with their limits and how many events they hold today and yesterday"""
+    return FeedResponse({
+        "feeds": [
+            {
+                "name": feed.name,
+                "max_events_per_day": feed.store.max_events,
+                "retention_days": feed.store.retention_days,
+                **{day: feed.store.count(day) for day in DAYS}
+            }
+            for feed in feeds.values()
+        ]
+    })
 
 
-@app.post("/api/event")
-async def add_event(event: Event):
+@api.post("/event")
+async def add_event(
+    event: Event,
+    sync: bool = Query(False, description="Respond only once the event is on disk"),
+    feed: Feed = Depends(get_feed),
+):
     """Add a new event to today's feed"""
     try:
-        cleanup_old_events()
-        data = load_events()
-        
-        now = datetime.now()
-        stored_event = StoredEvent(
-            **event.model_dump(),
-            timestamp=now.strftime("%H:%M:%S"),
-            date=now.strftime("%Y-%m-%d")
-        )
-        
-        if "today" not in data:
-            data["today"] = []
-        
-        # Check max events limit
-        if len(data["today"]) >= MAX_EVENTS:
-            data["today"] = data["today"][:MAX_EVENTS-1]
-        
-        data["today"].insert(0, stored_event.model_dump())
-        save_events(data)
+        stored_events = await apply_change(feed, "add", {"events": [event.model_dump(mode="json")], "sync": sync})
         
         # Only log event creation, not regular fetches
         logger.info(f"\u2713 Event: [{event.type}] {event.title}")
         
-        return {"status": "success", "event": stored_event.model_dump()}
+        return FeedResponse({"status": "success", "event": stored_events[0]})
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error adding event: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/events/today")
-async def get_today_events():
-    """Get all events from today"""
-    cleanup_old_events()
-    data = load_events()
-    count = len(data.get("today", []))
-    return {
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "count": count,
-        "events": data.get("today", [])
-    }
+@api.post("/events/batch")
+async def add_events(
+    events: List[Event],
+    sync: bool = Query(False, description="Respond only once the events are on disk"),
+    feed: Feed = Depends(get_feed),
+):
+    """Add several events to today's feed with a single write"""
+    try:
+        stored_events = await apply_change(
+            feed, "add", {"events": [event.model_dump(mode="json") for event in events], "sync": sync}
+        )
+        
+        for event in events:
+            logger.info(f"\u2713 Event: [{event.type}] {event.title}")
+        
+        return FeedResponse({
+            "status": "success",
+            "count": len(stored_events),
+            "events": stored_events
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error adding events: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/events/yesterday")
-async def get_yesterday_events():
-    """Get all events from yesterday"""
-    cleanup_old_events()
-    data = load_events()
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    count = len(data.get("yesterday", []))
+@api.patch("/event/{event_id}")
+async def update_event(event_id: str, changes: EventUpdate, feed: Feed = Depends(get_feed)):
+    """Fill in the image of an event that was added with a client-supplied id"""
+    event = await apply_change(
+        feed, "update", {"id": event_id, "changes": changes.model_dump(exclude_unset=True)}
+    )
+    if event is None:
+        raise HTTPException(status_code=404, detail=f"No event with id {event_id} today or yesterday")
+    
+    return FeedResponse({"status": "success", "event": event})
+
+
+@api.get("/events")
+async def get_events(
+    request: Request,
+    days: int = Query(len(DAYS), ge=1, le=len(DAYS)),
+    start: Optional[date] = Query(None, alias="from", description="First date of a history range"),
+    end: Optional[date] = Query(None, alias="to", description="Last date of a history range"),
+    since_seq: Optional[int] = Query(None, ge=0, description="Only what changed after this seq"),
+    query: EventQuery = Depends(event_query),
+    feed: Feed = Depends(get_feed),
+):
+    """Get today and yesterday in one response, or a range of days with from/to"""
+    store = feed.store
+    store.ensure_current()
+    
+    if since_seq is not None:
+        if feed.replica is not None and since_seq > store.last_seq:
+            # The client saw this seq through a worker that got it first
+            await feed.replica.wait_for(since_seq, CATCH_UP_TIMEOUT)
+        # Every change to today and yesterday takes a seq, so the latest
+        # one identifies the state the client ends up with
+        etag = feed_etag(request, f"seq-{store.last_seq}")
+        return cached_response(request, encode_payload(request, etag, delta_payload(store, since_seq, query)))
+    
+    if start is None and end is None:
+        selected = DAYS[:days]
+        version = "-".join(f"{day}-{store.version(day)}" for day in selected)
+        encoded = await cached_body(
+            feed,
+            request,
+            f"days{days}:{query}",
+            version,
+            lambda: {
+                day: day_payload(store.partition(store.day_date(day)), store.day_date(day), query)
+                for day in selected
+            }
+        )
+        return cached_response(request, encoded)
+    
+    # Only the partitions inside the range are read
+    dates = store.dates(start, end)
+    version = "-".join(f"{day}-{store.version(day)}" for day in (*DAYS, "history"))
+    
+    async def build() -> dict:
+        partitions = await store.load_partitions(dates)
+        return {
+            "from": dates[-1].isoformat() if dates else None,
+            "to": dates[0].isoformat() if dates else None,
+            "days": [day_payload(partitions[day_date], day_date, query) for day_date in dates]
+        }
+    
+    encoded = await cached_body(feed, request, f"range{start}:{end}:{query}", version, build)
+    return cached_response(request, encoded)
+
+
+@api.get("/events/{day}")
+async def get_day_events(
+    day: str,
+    request: Request,
+    query: EventQuery = Depends(event_query),
+    feed: Feed = Depends(get_feed),
+):
+    """Get the events of today, yesterday or any retained date (YYYY-MM-DD)"""
+    store = feed.store
+    store.ensure_current()
+    day_date = resolve_day(feed, day)
+    
+    async def build() -> dict:
+        partitions = await store.load_partitions([day_date])
+        return day_payload(partitions[day_date], day_date, query)
+    
+    encoded = await cached_body(feed, request, f"{day_date}:{query}", date_version(store, day_date), build)
+    return cached_response(request, encoded)
+
+
+def stats_payload(day_events: DayEvents, day_date: date, query: EventQuery) -> dict:
+    """Build the statistics of one day"""
     return {
-        "date": yesterday,
-        "count": count,
-        "events": data.get("yesterday", [])
+        "date": day_date.strftime("%Y-%m-%d"),
+        **day_events.stats(types=query.types, priorities=query.priorities)
     }
 
 
-@app.delete("/api/events/{day}")
-async def clear_events(day: str):
-    """Clear events for a specific day (today or yesterday)"""
-    if day not in ["today", "yesterday"]:
-        raise HTTPException(status_code=400, detail="Day must be 'today' or 'yesterday'")
+@api.get("/stats")
+async def get_stats(
+    request: Request,
+    start: Optional[date] = Query(None, alias="from", description="First date of a history range"),
+    end: Optional[date] = Query(None, alias="to", description="Last date of a history range"),
+    type: Optional[str] = Query(None, description="Comma-separated event types"),
+    priority: Optional[str] = Query(None, description="Comma-separated priorities"),
+    feed: Feed = Depends(get_feed),
+):
+    """Count the events of today and yesterday, or a range of days, by type, priority and hour.
+
+    The counts are kept up to date as events come and go, so this is
+    cheap no matter how many events are stored.
+    """
+    store = feed.store
+    store.ensure_current()
+    query = EventQuery(types=split_list(type), priorities=split_list(priority))
+    
+    if start is None and end is None:
+        version = "-".join(f"{day}-{store.version(day)}" for day in DAYS)
+        encoded = await cached_body(
+            feed,
+            request,
+            f"stats:{query}",
+            version,
+            lambda: {
+                day: stats_payload(store.partition(store.day_date(day)), store.day_date(day), query)
+                for day in DAYS
+            }
+        )
+        return cached_response(request, encoded)
     
-    data = load_events()
-    count = len(data.get(day, []))
-    data[day] = []
-    save_events(data)
+    dates = store.dates(start, end)
+    version = "-".join(f"{day}-{store.version(day)}" for day in (*DAYS, "history"))
+    
+    async def build() -> dict:
+        partitions = await store.load_partitions(dates)
+        return {
+            "from": dates[-1].isoformat() if dates else None,
+            "to": dates[0].isoformat() if dates else None,
+            "days": [stats_payload(partitions[day_date], day_date, query) for day_date in dates]
+        }
+    
+    encoded = await cached_body(feed, request, f"stats:range{start}:{end}:{query}", version, build)
+    return cached_response(request, encoded)
+
+
+@api.get("/search")
+async def search_events(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Words that must all occur in the title, text or type"),
+    start: Optional[date] = Query(None, alias="from", description="First date to search"),
+    end: Optional[date] = Query(None, alias="to", description="Last date to search"),
+    type: Optional[str] = Query(None, description="Comma-separated event types"),
+    priority: Optional[str] = Query(None, description="Comma-separated priorities"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    sort: str = Query("relevance", pattern="^(relevance|newest)$", description="Best match or newest first"),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0, description="Number of results to skip (next page)"),
+    feed: Feed = Depends(get_feed),
+):
+    """Search the events of all retained days.
+
+    Every word also matches the words it is the start of, so "deliv"
+    finds "delivery". Each event carries its ``score``; ``count`` is the
+    number of matches and ``next_offset`` is set when there are more.
+    """
+    store = feed.store
+    store.ensure_current()
+    query = EventQuery(types=split_list(type), priorities=split_list(priority), fields=split_list(fields))
+    version = "-".join(f"{day}-{store.version(day)}" for day in (*DAYS, "history"))
+    
+    async def build() -> dict:
+        count, results = await store.search(
+            q,
+            start,
+            end,
+            query.types,
+            query.priorities,
+            limit=limit,
+            offset=offset,
+            newest_first=sort == "newest"
+        )
+        payload = {
+            "query": q,
+            "count": count,
+            "events": [{**query.project(event), "score": round(score, 3)} for score, event in results]
+        }
+        if count > offset + limit:
+            payload["next_offset"] = offset + limit
+        return payload
+    
+    encoded = await cached_body(
+        feed, request, f"search:{q}:{start}:{end}:{query}:{sort}:{limit}:{offset}", version, build
+    )
+    return cached_response(request, encoded)
+
+
+@api.get("/stream")
+async def stream_events(query: EventQuery = Depends(event_query), feed: Feed = Depends(get_feed)):
+    """Push inserts, updates, clears and rollovers as server-sent events.
+
+    Accepts the same filters as the read endpoints; inserts that don't
+    match them are not sent.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    feed.stream_queues[queue] = query
+    return StreamingResponse(
+        stream_messages(feed, queue, query),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+@api.delete("/events/{day}")
+async def clear_events(day: str, feed: Feed = Depends(get_feed)):
+    """Clear events for today, yesterday or any retained date (YYYY-MM-DD)"""
+    count = await apply_change(feed, "clear", {"day": day})
     
     logger.info(f"Cleared {count} event(s) for {day}")
     
-    return {"status": "success", "cleared": day, "count": count}
+    return FeedResponse({"status": "success", "cleared": day, "count": count})
+
+
+# The default feed keeps the original paths
+app.include_router(api, prefix="/api")
+app.include_router(api, prefix="/api/feeds/{feed}")
+
+
+async def serve_workers() -> int:
+    """Own the feeds as the primary and serve HTTP from WORKERS uvicorn processes.
+
+    Returns once stopped by a signal, or with an error status if the
+    workers exit on their own.
+    """
+    await startup_event()
+    socket_dir = Path(tempfile.mkdtemp(prefix="daily_activity_feed-"))
+    primaries = [
+        Primary(feed.store, feed.socket_path(socket_dir), partial(answer_worker, feed))
+        for feed in feeds.values()
+    ]
+    for primary in primaries:
+        await primary.start()
+    workers = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "app:app",
+        "--app-dir", str(Path(__file__).resolve().parent),
+        "--host", "0.0.0.0",
+        "--port", str(PORT),
+        "--workers", str(WORKERS),
+        "--log-level", "warning",
+        "--no-access-log",
+        "--timeout-keep-alive", "330",
+        "--timeout-graceful-shutdown", "3",
+        env={**os.environ, "PRIMARY_SOCKETS": str(socket_dir), "INSTANCE_ID": INSTANCE_ID}
+    )
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    exited = asyncio.create_task(workers.wait())
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait((exited, stopped), return_when=asyncio.FIRST_COMPLETED)
+    status = 0
+    if exited.done():
+        logger.error(f"Worker processes exited with status {workers.returncode}")
+        status = 1
+    else:
+        workers.terminate()
+        await exited
+    stopped.cancel()
+    
+    for primary in primaries:
+        await primary.close()
+    socket_dir.rmdir()
+    await shutdown_event()
+    return status
 
 
 if __name__ == "__main__":
+    if WORKERS > 1:
+        sys.exit(asyncio.run(serve_workers()))
     uvicorn.run(
         app,
         host="0.0.0.0",
         port=PORT,
         log_level="warning",  # Only show warnings and errors
-        access_log=False  # Disable access logging
+        access_log=False,  # Disable access logging
+        timeout_keep_alive=330,  # Let the integration reuse idle connections
+        timeout_graceful_shutdown=3  # Don't wait forever on open streams
     )
@@ -0,0 +1,37 @@
+"""JSON encoding for the Daily Activity Feed add-on
+
+Uses orjson when it is installed and the standard library otherwise;
+orjson is optional because it has no wheels for every architecture the
+add-on is built for. Both backends produce the same compact UTF-8 JSON,
+so files written by one are read by the other.
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+
+    def dumps(obj: Any) -> bytes:
+        """Encode an object as compact UTF-8 JSON"""
+        return orjson.dumps(obj)
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Decode JSON (raises ValueError if it is malformed)"""
+        return orjson.loads(data)
+
+else:
+
+    def dumps(obj: Any) -> bytes:
+        """Encode an object as compact UTF-8 JSON"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Decode JSON (raises ValueError if it is malformed)"""
+        return json.loads(data)
@@ -0,0 +1,290 @@
+"""Prometheus metrics for the Daily Activity Feed add-on
+
+A small in-process registry rendered in the Prometheus text format.
+Recording a sample is a dict lookup plus a bisect, so it stays on in
+production. Series are updated from the event loop and the writer thread
+alike (a day partition can fail to load on one and to save on the
+other), so increments take a lock shared by all series.
+"""
+import abc
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# The charset is added by the response
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Bytes
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+_registry: List["Metric"] = []
+
+# Uncontended almost always, so cheap next to the dict lookup
+_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(abc.ABC):
+    """A named family of series, one per combination of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._series: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def labels(self, *values: str):
+        """Return the series for the given label values, creating it on first use"""
+        series = self._series.get(values)
+        if series is None:
+            # Another thread may be creating it too; keep whichever came first
+            series = self._series.setdefault(values, self._new_series())
+        return series
+
+    @abc.abstractmethod
+    def _new_series(self):
+        """Return a new series of this kind"""
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]:
+        """Yield the sample lines of every series"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with _lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def _new_series(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        """Increment the series without labels"""
+        self.labels().inc(amount)
+
+    def take(self) -> List[list]:
+        """Return what was counted as [label values, amount] and start again from zero"""
+        with _lock:
+            taken = [[list(values), series.value] for values, series in self._series.items() if series.value]
+            for series in self._series.values():
+                series.value = 0.0
+        return taken
+
+    def merge(self, taken: List[list]) -> None:
+        """Add what another process counted"""
+        for values, amount in taken:
+            self.labels(*values).inc(amount)
+
+    def samples(self) -> Iterator[str]:
+        for values, series in sorted(self._series.items()):
+            yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(series.value)}"
+
+
+class Gauge(Counter):
+    """A value that is set, or read from a callback when the metrics are rendered"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float) -> None:
+        """Set the series without labels"""
+        self.labels().set(value)
+
+    def samples(self) -> Iterator[str]:
+        if self.collect is not None:
+            for values, value in self.collect().items():
+                self.labels(*values).set(value)
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Counts of observations in cumulative buckets, plus their sum"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_series(self) -> "_HistogramSeries":
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """Record a value in the series without labels"""
+        self.labels().observe(value)
+
+    def take(self) -> List[list]:
+        """Return what was observed as [label values, bucket counts, sum, count] and start again from zero"""
+        taken = []
+        with _lock:
+            for values, series in self._series.items():
+                if series.count:
+                    taken.append([list(values), series.counts, series.sum, series.count])
+                    series.counts = [0] * len(series.counts)
+                    series.sum = 0.0
+                    series.count = 0
+        return taken
+
+    def merge(self, taken: List[list]) -> None:
+        """Add what another process observed"""
+        for values, counts, total, count in taken:
+            series = self.labels(*values)
+            with _lock:
+                series.counts = [mine + theirs for mine, theirs in zip(series.counts, counts)]
+                series.sum += total
+                series.count += count
+
+    def samples(self) -> Iterator[str]:
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}"
+            labels = _format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(series.sum)}"
+            yield f"{self.name}_count{labels} {series.count}"
+
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # One count per bucket plus +Inf, cumulated only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        bucket = bisect_left(self.buckets, value)
+        with _lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+
+def take(selected: Iterable[Metric]) -> Dict[str, list]:
+    """Return what counters and histograms recorded and reset them, for the process that sums them up"""
+    return {metric.name: metric.take() for metric in selected}
+
+
+def merge(selected: Iterable[Metric], taken: Dict[str, list]) -> None:
+    """Add what another process recorded, as returned by take()"""
+    for metric in selected:
+        if metric.name in taken:
+            metric.merge(taken[metric.name])
+
+
+def render(only: Optional[Iterable[Metric]] = None, exclude: Iterable[Metric] = ()) -> str:
+    """Return the registered metrics (or only some of them) in the Prometheus text format"""
+    selected = _registry if only is None else [metric for metric in _registry if metric in only]
+    return "\n".join(metric.render() for metric in selected if metric not in exclude) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route.
+
+    Routes are labelled by their template (``/api/events/{day}``), so
+    arbitrary paths can't blow up the number of series. The latency is
+    measured until the response starts, which keeps long-lived streams
+    from skewing it; the body size (as sent, so possibly compressed) is recorded for
+    JSON responses.
+    """
+
+    def __init__(self, app, requests: Counter, latency: Histogram, sizes: Histogram) -> None:
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.sizes = sizes
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        json_body = False
+
+        async def send_wrapper(message) -> None:
+            nonlocal status, size, json_body
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                route = scope.get("route")
+                path = route.path if route is not None else "unmatched"
+                self.latency.labels(scope["method"], path).observe(time.perf_counter() - start)
+                json_body = any(
+                    name == b"content-type" and value.split(b";")[0].endswith(b"json")
+                    for name, value in message.get("headers", ())
+                )
+            elif message["type"] == "http.response.body" and json_body:
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            self.requests.labels(scope["method"], path, str(status)).inc()
+            if json_body:
+                self.sizes.labels(path).observe(size)
@@ -0,0 +1,294 @@
+"""Serving the Daily Activity Feed from several worker processes
+
+With more than one worker, a primary process owns the store: it loads
+it, applies every change and is the only process that writes the files.
+HTTP is served by uvicorn worker processes, each holding a replica of
+the store in memory, so reads, JSON encoding and compression run on all
+cores. A worker forwards its changes to the primary over a Unix socket;
+the primary streams every change it makes back to all replicas, in
+order and before it replies, so a worker always sees its own writes.
+
+Messages are JSON lines. A replica first receives the primary's state,
+then pushed changes (``{"change": ...}``) mixed with replies to its
+requests (``{"id": ...}``). Replicas apply changes through the same store
+methods as the primary, which keeps their sequence ids, journals, search
+indexes and versions (and so ETags) identical to it; a replica that
+drifts anyway reconnects and starts over from a fresh state.
+"""
+import asyncio
+import logging
+from datetime import date
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+import codec
+from store import UPDATABLE_FIELDS, EventStore, Record
+
+logger = logging.getLogger(__name__)
+
+# Largest message, which is usually the state sent to a new replica
+MESSAGE_LIMIT = 64 * 1024 * 1024
+
+# A replica that has this much unread is dropped and has to reconnect
+MAX_BACKLOG = 16 * 1024 * 1024
+
+# Seconds between attempts to reach the primary, doubling up to the maximum
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX = 5.0
+
+
+def _encode(message: dict) -> bytes:
+    return codec.dumps(message) + b"\n"
+
+
+class RemoteError(Exception):
+    """A forwarded request failed in the primary or couldn't reach it"""
+
+    def __init__(self, status: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class ReplicaStore(EventStore):
+    """A store that follows the primary's changes and never writes files"""
+
+    def ensure_current(self) -> bool:
+        # Rollovers come from the primary
+        return False
+
+    def _queue(self, *jobs) -> None:
+        pass
+
+    def _append(self, *records: dict) -> None:
+        pass
+
+    def _write_partition(self, day_date: date, events) -> None:
+        pass
+
+    def compact(self) -> None:
+        pass
+
+    def apply(self, message: dict) -> bool:
+        """Make a change the primary made; returns False if the replica no longer matches it"""
+        kind = message["change"]
+        if kind == "insert":
+            event = Record.from_dict(message["event"])
+            expected = event.seq
+            self.add(event)
+            return event.seq == expected
+        if kind == "update":
+            self.update(message["id"], message["changes"])
+        elif kind == "clear":
+            self.clear_date(date.fromisoformat(message["date"]))
+        elif kind == "rollover":
+            self.rollover(date.fromisoformat(message["date"]))
+        return self._next_seq == message["next_seq"]
+
+
+class Primary:
+    """Serves the store to the worker processes over a Unix socket.
+
+    Requests are answered by ``handler(op, args)`` concurrently, so a
+    request waiting for its commit doesn't hold up the others.
+    """
+
+    def __init__(self, store: EventStore, path: Path, handler: Callable[[str, dict], Awaitable]) -> None:
+        self.store = store
+        self.path = path
+        self.handler = handler
+        self._replicas: Set[asyncio.StreamWriter] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        store.add_listener(self._broadcast)
+
+    async def start(self) -> None:
+        """Listen for replicas"""
+        self.path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=MESSAGE_LIMIT)
+
+    async def close(self) -> None:
+        """Disconnect every replica and stop listening"""
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._replicas):
+            writer.close()
+        await self._server.wait_closed()
+        self.path.unlink(missing_ok=True)
+
+    def _broadcast(self, kind: str, data: dict) -> None:
+        """Push a change of the store to every replica"""
+        if not self._replicas:
+            return
+        message = {"change": kind, "next_seq": self.store.last_seq + 1}
+        if kind == "insert":
+            message["event"] = data["event"].to_dict()
+        elif kind == "update":
+            event = data["event"]
+            message["id"] = event.id
+            message["changes"] = {key: getattr(event, key) for key in UPDATABLE_FIELDS}
+        else:
+            message["date"] = data["date"]
+        line = _encode(message)
+
+        for writer in list(self._replicas):
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                logger.warning("Dropping a worker that fell behind")
+                self._replicas.discard(writer)
+                writer.close()
+                continue
+            writer.write(line)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Send a new replica the current state, then answer its requests"""
+        # Nothing is awaited in between, so every later change is pushed after the state
+        writer.write(_encode({"state": self.store.state()}))
+        self._replicas.add(writer)
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._answer(writer, codec.loads(line)))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Lost a worker: {e}")
+        finally:
+            self._replicas.discard(writer)
+            writer.close()
+
+    async def _answer(self, writer: asyncio.StreamWriter, request: dict) -> None:
+        """Run one request and reply with its result or error"""
+        try:
+            reply = {"id": request["id"], "result": await self.handler(request["op"], request["args"])}
+        except Exception as e:
+            reply = {
+                "id": request["id"],
+                "status": getattr(e, "status_code", 500),
+                "error": getattr(e, "detail", None) or str(e),
+            }
+        if not writer.is_closing():
+            writer.write(_encode(reply))
+
+
+class Replica:
+    """Keeps a worker's store in sync with the primary and forwards its requests"""
+
+    def __init__(self, store: ReplicaStore, path: Path) -> None:
+        self.store = store
+        self.path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 1
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Connect to the primary and load its state"""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                await self._connect()
+                break
+            except OSError:
+                # The primary may still be starting its listener
+                if delay > RECONNECT_MAX:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Disconnect from the primary"""
+        if self._task is not None:
+            self._task.cancel()
+        self._disconnect()
+
+    async def _connect(self) -> None:
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=MESSAGE_LIMIT)
+        try:
+            message = codec.loads(await reader.readline())
+            self.store.restore(message["state"])
+        except Exception:
+            writer.close()
+            raise
+        self._reader, self._writer = reader, writer
+        self._notify_changed()
+
+    def _disconnect(self) -> None:
+        """Drop the connection and fail the requests still waiting on it"""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RemoteError(503, "Lost the connection to the primary process"))
+
+    def _notify_changed(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _run(self) -> None:
+        """Apply pushed changes and hand out replies, reconnecting whenever the connection is lost"""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                if self._reader is None:
+                    await self._connect()
+                    logger.info("Reconnected to the primary process")
+                delay = RECONNECT_DELAY
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Connection to the primary process failed: {e}")
+            self._disconnect()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    async def _listen(self) -> None:
+        """Handle messages until the connection closes or the replica drifts"""
+        while line := await self._reader.readline():
+            message = codec.loads(line)
+            if "change" in message:
+                # An older day the change touches is read off the event loop first
+                day_date = message.get("date") or message.get("event", {}).get("date")
+                if day_date:
+                    await self.store.load_partitions([date.fromisoformat(day_date)])
+                if not self.store.apply(message):
+                    logger.warning("Replica out of sync with the primary - reloading")
+                    return
+                self._notify_changed()
+                continue
+            future = self._pending.pop(message["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in message:
+                future.set_exception(RemoteError(message["status"], message["error"]))
+            else:
+                future.set_result(message["result"])
+
+    async def request(self, op: str, args: dict):
+        """Have the primary run a request and return its result"""
+        if self._writer is None:
+            raise RemoteError(503, "The primary process is not reachable")
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(_encode({"id": request_id, "op": op, "args": args}))
+        return await future
+
+    async def wait_for(self, seq: int, timeout: float) -> None:
+        """Wait until a seq seen through another worker has arrived here, at most timeout seconds"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.store.last_seq < seq:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
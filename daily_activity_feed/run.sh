@@ -8,14 +8,28 @@ bashio::log.info "------------------------------------------"
 # Get configuration from options
 PORT=$(bashio::config 'port')
 MAX_EVENTS=$(bashio::config 'max_events_per_day')
+RETENTION_DAYS=$(bashio::config 'retention_days')
+DURABILITY=$(bashio::config 'durability')
+FLUSH_INTERVAL_MS=$(bashio::config 'flush_interval_ms')
+WORKERS=$(bashio::config 'workers')
+FEEDS=$(bashio::jq "/data/options.json" '.feeds // []')
 
 bashio::log.info "Configuration:"
 bashio::log.info "  Port: ${PORT}"
 bashio::log.info "  Max events per day: ${MAX_EVENTS}"
+bashio::log.info "  Retention: ${RETENTION_DAYS} days"
+bashio::log.info "  Durability: ${DURABILITY} (every ${FLUSH_INTERVAL_MS} ms)"
+bashio::log.info "  Workers: ${WORKERS}"
+bashio::log.info "  Feeds: $(bashio::jq "${FEEDS}" '[.[].name] | join(", ")')"
 
 # Export for Python app
 export PORT=${PORT}
 export MAX_EVENTS=${MAX_EVENTS}
+export RETENTION_DAYS=${RETENTION_DAYS}
+export DURABILITY=${DURABILITY}
+export FLUSH_INTERVAL_MS=${FLUSH_INTERVAL_MS}
+export WORKERS=${WORKERS}
+export FEEDS="${FEEDS}"
 
 bashio::log.info "------------------------------------------"
 bashio::log.info "Launching API server..."
@@ -0,0 +1,218 @@
+"""Full-text search for the Daily Activity Feed add-on
+
+An inverted index maps every word of an event's title, text and type to
+the events containing it, so a query only touches the postings of its own
+words instead of scanning the retained days. The store keeps it current
+as events are added, evicted and cleared, and trims it at rollover.
+
+Matches are ranked with BM25. Every query word must match; it also
+matches the words it is the start of ("deliv" finds "delivery"), which
+count less than an exact match. The index keeps only the date, seq,
+type and priority of each event besides its postings, so it doesn't hold
+the retained days in memory; the store reads the events of the page of
+results it returns.
+"""
+import math
+import re
+import sys
+from bisect import bisect_left, insort
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Words are runs of letters and digits; underscores separate them, so the
+# type "package_delivery" is found by "delivery"
+_WORD = re.compile(r"[^\W_]+")
+# The same for ASCII text, which a plain character class matches faster
+_ASCII_WORD = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters: term frequency saturation and length normalisation
+K1 = 1.2
+B = 0.75
+
+# Query words shorter than this only match whole words
+MIN_PREFIX = 2
+
+# Score factor for a word that a query word is only the start of
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words"""
+    text = text.casefold()
+    if text.isascii():
+        return _ASCII_WORD.findall(text)
+    return _WORD.findall(text)
+
+
+class _Document:
+    """An indexed event: where it is stored, what it is filtered by and its distinct words"""
+
+    __slots__ = ("date", "seq", "type", "priority", "words")
+
+    def __init__(self, day_date: date, event, words: Tuple[str, ...]) -> None:
+        self.date = day_date
+        self.seq = event.seq
+        # Few distinct values, shared by every document
+        self.type = sys.intern(event.type)
+        self.priority = sys.intern(event.priority)
+        self.words = words
+
+
+class SearchIndex:
+    """Inverted index over the events of the retained days.
+
+    Events are identified by their date and ``seq``. Postings map a
+    document to the weighted frequency of the word in it, and the sorted
+    vocabulary turns prefix matching into a bisect.
+    """
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._vocabulary: List[str] = []
+        self._documents: Dict[int, _Document] = {}
+        # Weighted number of words per document, kept apart for the scoring loop
+        self._lengths: Dict[int, int] = {}
+        self._by_date: Dict[date, Dict[int, int]] = {}
+        self._next_id = 0
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def clear(self) -> None:
+        """Forget every event"""
+        self._postings.clear()
+        self._vocabulary.clear()
+        self._documents.clear()
+        self._lengths.clear()
+        self._by_date.clear()
+        self._total_length = 0
+
+    def add(self, day_date: date, event) -> None:
+        """Index an event stored under a date, replacing one with the same seq"""
+        # Titles are short and to the point, so their words count twice
+        frequencies: Dict[str, int] = {}
+        for word in tokenize(event.title):
+            frequencies[word] = frequencies.get(word, 0) + 2
+        for word in tokenize(f"{event.text} {event.type}"):
+            frequencies[word] = frequencies.get(word, 0) + 1
+
+        day = self._by_date.setdefault(day_date, {})
+        if event.seq in day:
+            self._remove(day.pop(event.seq))
+        doc_id = self._next_id
+        self._next_id += 1
+        length = sum(frequencies.values())
+        words = []
+        for word, frequency in frequencies.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                insort(self._vocabulary, word)
+            postings[doc_id] = frequency
+            # Refer to the vocabulary's copy of the word, not this event's
+            words.append(self._vocabulary[bisect_left(self._vocabulary, word)])
+        self._documents[doc_id] = _Document(day_date, event, tuple(words))
+        self._lengths[doc_id] = length
+        day[event.seq] = doc_id
+        self._total_length += length
+
+    def _remove(self, doc_id: int) -> None:
+        """Drop a document from the postings"""
+        document = self._documents.pop(doc_id)
+        self._total_length -= self._lengths.pop(doc_id)
+        for word in document.words:
+            postings = self._postings[word]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect_left(self._vocabulary, word)]
+
+    def remove(self, day_date: date, seq: int) -> None:
+        """Forget an event"""
+        day = self._by_date.get(day_date)
+        if day is None or seq not in day:
+            return
+        self._remove(day.pop(seq))
+        if not day:
+            del self._by_date[day_date]
+
+    def remove_date(self, day_date: date) -> None:
+        """Forget every event of a date"""
+        for doc_id in self._by_date.pop(day_date, {}).values():
+            self._remove(doc_id)
+
+    def trim(self, oldest: date, newest: date) -> None:
+        """Forget every date outside oldest..newest"""
+        for day_date in [d for d in self._by_date if not oldest <= d <= newest]:
+            self.remove_date(day_date)
+
+    def _expand(self, word: str) -> List[str]:
+        """Return the indexed words a query word matches"""
+        if len(word) < MIN_PREFIX:
+            return [word] if word in self._postings else []
+        vocabulary = self._vocabulary
+        i = bisect_left(vocabulary, word)
+        matches = []
+        while i < len(vocabulary) and vocabulary[i].startswith(word):
+            matches.append(vocabulary[i])
+            i += 1
+        return matches
+
+    def search(
+        self,
+        text: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        types: Optional[Iterable[str]] = None,
+        priorities: Optional[Iterable[str]] = None,
+    ) -> List[Tuple[float, date, int]]:
+        """Return (score, date, seq) for every event matching all words of a query, unordered"""
+        words = list(dict.fromkeys(tokenize(text)))
+        if not words or not self._documents:
+            return []
+
+        # Start with the rarest word, so the candidates shrink quickly
+        expanded = sorted(
+            ((word, self._expand(word)) for word in words),
+            key=lambda item: sum(len(self._postings[match]) for match in item[1]),
+        )
+        count = len(self._documents)
+        lengths = self._lengths
+        # BM25 as weight * f / (f + base + per_length * length)
+        base = K1 * (1 - B)
+        per_length = K1 * B * count / max(self._total_length, 1)
+        scores: Optional[Dict[int, float]] = None
+        for word, matches in expanded:
+            word_scores: Dict[int, float] = {}
+            for match in matches:
+                postings = self._postings[match]
+                weight = (K1 + 1) * math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                if match != word:
+                    weight *= PREFIX_WEIGHT
+                for doc_id, frequency in postings.items():
+                    if scores is not None and doc_id not in scores:
+                        continue
+                    score = weight * frequency / (frequency + base + per_length * lengths[doc_id])
+                    # A word matching several indexed words counts once
+                    if score > word_scores.get(doc_id, 0.0):
+                        word_scores[doc_id] = score
+            if scores is not None:
+                word_scores = {doc_id: scores[doc_id] + score for doc_id, score in word_scores.items()}
+            scores = word_scores
+            if not scores:
+                return []
+
+        types = set(types) if types else None
+        priorities = set(priorities) if priorities else None
+        results = []
+        for doc_id, score in scores.items():
+            document = self._documents[doc_id]
+            if start is not None and document.date < start or end is not None and document.date > end:
+                continue
+            if types is not None and document.type not in types:
+                continue
+            if priorities is not None and document.priority not in priorities:
+                continue
+            results.append((score, document.date, document.seq))
+        return results
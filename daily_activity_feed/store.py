@@ -0,0 +1,1214 @@
+"""Resident event store for the Daily Activity Feed add-on
+
+Events are partitioned by day. Today's partition lives in memory; every
+change to it is appended as one compact JSON record to a write-ahead log
+(``events.log``) next to the snapshot (``events.json``). The log is
+periodically compacted into a new snapshot, which is written to a temp
+file and atomically renamed into place. On startup the snapshot is
+loaded and the log is replayed on top of it.
+
+At midnight today's partition is sealed into ``days/<date>.json``. Only
+yesterday's partition is kept resident; older ones are read on demand
+(off the event loop through ``load_partitions``) and deleted once they
+fall out of the retention window. A day whose write is still queued is
+kept in memory until the write lands, since its file is stale until then.
+
+Sequence ids are shared by inserts and by the changes that don't add an
+event (updates, clears and rollovers), which are also kept in a short
+in-memory journal. Together they let clients fetch only what changed
+after the last ``seq`` they have seen.
+
+The words of every retained event are kept in a search index, built from
+all days on startup and updated with every change after that.
+
+Nothing is written from the event loop while serving: changes only queue
+writes, which a writer task hands to a worker thread in order. Records
+that arrive within one flush interval share a single write (and fsync,
+depending on the durability mode).
+"""
+import asyncio
+import contextlib
+import heapq
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from datetime import date, timedelta
+from functools import partial
+from itertools import islice
+from operator import attrgetter, itemgetter
+from pathlib import Path
+from typing import BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import codec
+from metrics import SIZE_BUCKETS, Counter, Gauge, Histogram
+from search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+LOAD_SECONDS = Gauge(
+    "daily_activity_feed_store_load_seconds",
+    "Time spent loading the snapshot and replaying the log on startup"
+)
+WRITE_SECONDS = Histogram(
+    "daily_activity_feed_store_write_seconds",
+    "Duration of writes to the log, snapshot and day files, including fsync",
+    ("file",)
+)
+WRITE_BYTES = Histogram(
+    "daily_activity_feed_store_write_bytes",
+    "Size of writes to the log, snapshot and day files",
+    ("file",),
+    SIZE_BUCKETS
+)
+ERRORS = Counter(
+    "daily_activity_feed_store_errors_total",
+    "Failed or torn reads and writes of the log, snapshot and day files",
+    ("file",)
+)
+ROLLOVERS = Counter("daily_activity_feed_rollovers_total", "Days sealed at midnight")
+
+# Recorded only by the process that writes the files
+WRITE_METRICS = (LOAD_SECONDS, WRITE_SECONDS, WRITE_BYTES, ERRORS)
+
+# Report zeros from the start, so rates work before the first failure
+for _file in ("log", "snapshot", "day"):
+    ERRORS.labels(_file)
+ROLLOVERS.labels()
+
+DAYS = ("today", "yesterday")
+
+# Number of log records after which the log is folded into a snapshot
+COMPACT_EVERY = 1000
+
+# Days kept including today
+RETENTION_DAYS = 7
+
+# Older partitions kept in memory after being read
+COLD_CACHE_SIZE = 4
+
+# "fsync": every group commit is fsync'ed before the next one starts
+# "flush": group commits are handed to the OS, which writes them back
+# in its own time; snapshots, day files and sync commits are still fsync'ed
+DURABILITY_MODES = ("fsync", "flush")
+
+# Seconds the writer waits for more records before a group commit
+FLUSH_INTERVAL = 0.1
+
+# Fields that can be changed after an event was added
+UPDATABLE_FIELDS = ("image", "thumbnail")
+
+# Updates, clears and rollovers remembered for delta reads; clients
+# that are further behind get the full feed
+JOURNAL_SIZE = 1000
+
+
+_seq = attrgetter("seq")
+
+
+def _encode(record: dict) -> bytes:
+    """Encode a log record as a single compact JSON line"""
+    return codec.dumps(record) + b"\n"
+
+
+class Record:
+    """One stored event.
+
+    Slotted instead of a dict so a full day of events stays compact; it
+    is turned into a dict only when it is written or sent.
+    """
+
+    __slots__ = (
+        "id", "type", "title", "text", "image", "thumbnail", "priority", "timestamp", "date", "seq"
+    )
+
+    def __init__(
+        self,
+        type: str,
+        title: str,
+        text: str,
+        image: Optional[str] = None,
+        thumbnail: Optional[str] = None,
+        priority: str = "normal",
+        timestamp: str = "",
+        date: str = "",
+        seq: int = 0,
+        id: Optional[str] = None,
+    ) -> None:
+        self.id = id
+        self.type = type
+        self.title = title
+        self.text = text
+        self.image = image
+        self.thumbnail = thumbnail
+        self.priority = priority
+        self.timestamp = timestamp
+        self.date = date
+        self.seq = seq
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Record":
+        """Build a record from its JSON form, ignoring unknown keys"""
+        return cls(**{key: data[key] for key in cls.__slots__ if key in data})
+
+    def to_dict(self, fields: Optional[Iterable[str]] = None) -> dict:
+        """Return the JSON form, optionally reduced to the given fields"""
+        if fields is None:
+            return {key: getattr(self, key) for key in self.__slots__}
+        return {key: getattr(self, key) for key in fields if key in self.__slots__}
+
+
+def _save_file(path: Path, data: Optional[bytes], kind: str) -> bool:
+    """Atomically replace a file with data, or remove it if data is None.
+
+    The data is written to a temp file, fsync'ed and renamed into place,
+    so a crash never leaves a truncated file. Returns False on failure.
+    ``kind`` labels the file in the metrics.
+    """
+    try:
+        if data is None:
+            path.unlink(missing_ok=True)
+            return True
+        start = time.perf_counter()
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        WRITE_SECONDS.labels(kind).observe(time.perf_counter() - start)
+        WRITE_BYTES.labels(kind).observe(len(data))
+    except Exception as e:
+        logger.error(f"Error saving {path.name}: {e}")
+        ERRORS.labels(kind).inc()
+        return False
+    return True
+
+
+def _hour(event: Record) -> Optional[int]:
+    """Return the hour of the day an event was stamped at (None without a timestamp)"""
+    hour = event.timestamp[:2]
+    if hour.isdigit() and int(hour) < 24:
+        return int(hour)
+    return None
+
+
+def _newest_first(source: Deque[Record], lo: int, hi: int) -> Iterator[Record]:
+    """Iterate source[lo:hi] newest first without copying it"""
+    size = len(source)
+    return islice(reversed(source), size - hi, size - lo)
+
+
+class DayEvents:
+    """The events of one day plus secondary indexes for filtered reads.
+
+    Every index is a deque ordered oldest first (ascending ``seq``), used
+    as a ring buffer: inserting appends on the right and the cap evicts
+    on the left, both O(1) regardless of how many events the day holds.
+    Cursors are a bisect away and newest-first reads walk it reversed.
+
+    Per type and priority the events are also counted by the hour they
+    were stamped at, so statistics never walk the events.
+    """
+
+    def __init__(self, events: Iterable[Record] = ()) -> None:
+        self._by_seq: Deque[Record] = deque()
+        self._by_id: Dict[str, Record] = {}
+        self._by_type: Dict[str, Deque[Record]] = {}
+        self._by_priority: Dict[str, Deque[Record]] = {}
+        self._by_type_priority: Dict[Tuple[str, str], Deque[Record]] = {}
+        self._hours: Dict[Tuple[str, str], List[int]] = {}
+        for event in sorted(events, key=_seq):
+            self.insert(event)
+
+    @classmethod
+    def from_dicts(cls, events: Iterable[dict]) -> "DayEvents":
+        """Build a day from the JSON form of its events"""
+        return cls(Record.from_dict(event) for event in events)
+
+    def __len__(self) -> int:
+        return len(self._by_seq)
+
+    def get(self, event_id: str) -> Optional[Record]:
+        """Return the event with a client-supplied id, if it is still stored"""
+        return self._by_id.get(event_id)
+
+    def find(self, seq: int) -> Optional[Record]:
+        """Return the event with a sequence id, if it is still stored"""
+        i = bisect_left(self._by_seq, seq, key=_seq)
+        if i < len(self._by_seq) and self._by_seq[i].seq == seq:
+            return self._by_seq[i]
+        return None
+
+    def newest_first(self) -> Iterator[Record]:
+        """Iterate the feed newest first"""
+        return reversed(self._by_seq)
+
+    def to_dicts(self) -> List[dict]:
+        """Return the JSON form of the feed, newest first"""
+        return [event.to_dict() for event in self.newest_first()]
+
+    def _indexes(self, event: Record) -> Tuple[Tuple[dict, object], ...]:
+        """Return every keyed index together with the event's key in it"""
+        return (
+            (self._by_type, event.type),
+            (self._by_priority, event.priority),
+            (self._by_type_priority, (event.type, event.priority)),
+        )
+
+    def insert(self, event: Record, max_events: Optional[int] = None) -> List[Record]:
+        """Add the newest event and return the oldest ones evicted beyond max_events"""
+        evicted = []
+        if max_events is not None:
+            while len(self._by_seq) >= max_events:
+                evicted.append(self._evict_oldest())
+        self._by_seq.append(event)
+        if event.id is not None:
+            self._by_id[event.id] = event
+        for index, key in self._indexes(event):
+            entries = index.get(key)
+            if entries is None:
+                entries = index[key] = deque()
+            entries.append(event)
+        hour = _hour(event)
+        if hour is not None:
+            hours = self._hours.get((event.type, event.priority))
+            if hours is None:
+                hours = self._hours[(event.type, event.priority)] = [0] * 24
+            hours[hour] += 1
+        return evicted
+
+    def _evict_oldest(self) -> Record:
+        """Drop the oldest event from the feed and all indexes and return it"""
+        event = self._by_seq.popleft()
+        if event.id is not None and self._by_id.get(event.id) is event:
+            del self._by_id[event.id]
+        for index, key in self._indexes(event):
+            entries = index[key]
+            entries.popleft()
+            if not entries:
+                del index[key]
+        hour = _hour(event)
+        if hour is not None:
+            key = (event.type, event.priority)
+            self._hours[key][hour] -= 1
+            if key not in self._by_type_priority:
+                del self._hours[key]
+        return event
+
+    def query(
+        self,
+        types: Optional[List[str]] = None,
+        priorities: Optional[List[str]] = None,
+        after: Optional[int] = None,
+        before: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, List[Record]]:
+        """Return the number of matching events and a newest-first page.
+
+        ``after``/``before`` are exclusive ``seq`` bounds. Only the index
+        deques for the requested types/priorities are touched.
+        """
+        empty = ()
+        if types and priorities:
+            sources = [
+                self._by_type_priority.get((event_type, priority), empty)
+                for event_type in dict.fromkeys(types)
+                for priority in dict.fromkeys(priorities)
+            ]
+        elif types:
+            sources = [self._by_type.get(event_type, empty) for event_type in dict.fromkeys(types)]
+        elif priorities:
+            sources = [self._by_priority.get(priority, empty) for priority in dict.fromkeys(priorities)]
+        else:
+            sources = [self._by_seq]
+
+        ranges = []
+        for source in sources:
+            lo = 0 if after is None else bisect_right(source, after, key=_seq)
+            hi = len(source) if before is None else bisect_left(source, before, key=_seq)
+            if lo < hi:
+                ranges.append((source, lo, hi))
+
+        total = sum(hi - lo for _, lo, hi in ranges)
+        if limit == 0 or not ranges:
+            return total, []
+        if len(ranges) == 1:
+            merged = _newest_first(*ranges[0])
+        else:
+            merged = heapq.merge(
+                *(_newest_first(*r) for r in ranges), key=_seq, reverse=True
+            )
+        return total, list(islice(merged, limit))
+
+
+    def stats(
+        self, types: Optional[Iterable[str]] = None, priorities: Optional[Iterable[str]] = None
+    ) -> dict:
+        """Count the events by type, by priority and by hour of the day.
+
+        Only the running counters of the requested types/priorities are
+        summed, whatever the number of events.
+        """
+        by_type: Dict[str, int] = {}
+        by_priority: Dict[str, int] = {}
+        hours = [0] * 24
+        for (event_type, priority), entries in self._by_type_priority.items():
+            if types and event_type not in types or priorities and priority not in priorities:
+                continue
+            by_type[event_type] = by_type.get(event_type, 0) + len(entries)
+            by_priority[priority] = by_priority.get(priority, 0) + len(entries)
+            for hour, count in enumerate(self._hours.get((event_type, priority), ())):
+                hours[hour] += count
+        return {
+            "count": sum(by_type.values()),
+            "types": dict(sorted(by_type.items())),
+            "priorities": dict(sorted(by_priority.items())),
+            "hours": hours,
+        }
+
+
+class EventStore:
+    """Keeps recent days in memory and persists the feed in day partitions"""
+
+    def __init__(
+        self,
+        path: Path,
+        max_events: int,
+        retention_days: int = RETENTION_DAYS,
+        compact_every: int = COMPACT_EVERY,
+        durability: str = "fsync",
+        flush_interval: float = FLUSH_INTERVAL,
+    ) -> None:
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}")
+        self.path = path
+        self.log_path = path.with_suffix(".log")
+        self.days_dir = path.parent / "days"
+        self.max_events = max_events
+        self.retention_days = max(retention_days, len(DAYS))
+        self.compact_every = compact_every
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self._data = {day: DayEvents() for day in DAYS}
+        self._cold: "OrderedDict[date, DayEvents]" = OrderedDict()
+        # Sealed days with writes still queued or being retried, as
+        # [events, number of writes]; updated from the writer thread too
+        self._pending: Dict[date, list] = {}
+        self._pending_lock = threading.Lock()
+        # Partition writes queued so far per date, to tell whether a day
+        # read from disk may have missed one
+        self._partition_writes: Dict[date, int] = {}
+        self._next_seq = 1
+        # Changes other than inserts as (seq, tombstone or updated event),
+        # complete for every seq after _journal_floor
+        self._journal: Deque[Tuple[int, Union[dict, Record]]] = deque()
+        self._journal_floor = 0
+        self._index = SearchIndex()
+        self._date: Optional[date] = None
+        self._versions = {day: 0 for day in (*DAYS, "history")}
+        self._listeners: List[Callable[[str, dict], None]] = []
+        self._log: Optional[BinaryIO] = None
+        self._log_seq = 0
+        self._log_records = 0
+        self._unsynced = False
+        # The last log write failed and may have stopped mid-record
+        self._log_failed = False
+        # Queued writes: log lines, or callables for whole-file writes
+        self._jobs: List[Union[bytes, Callable[[], None]]] = []
+        self._waiters: List[asyncio.Future] = []
+        self._dirty = asyncio.Event()
+        self._urgent = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def load(self) -> None:
+        """Load the snapshot and replay the write-ahead log on top of it"""
+        start = time.perf_counter()
+        self.days_dir.mkdir(parents=True, exist_ok=True)
+        snapshot_seq = self._load_snapshot()
+        self._log_seq = snapshot_seq
+        replayed, torn = self._replay_log(snapshot_seq)
+        if replayed:
+            logger.info(f"Replayed {replayed} record(s) from {self.log_path.name}")
+        if replayed or torn:
+            self.compact()
+        self._open_log()
+        self._journal.clear()
+        self._journal_floor = self.last_seq
+        self._reindex()
+        # Nothing is being served yet, so startup writes may block
+        jobs, self._jobs = self._jobs, []
+        try:
+            self._write(jobs, fsync=True)
+        except OSError as e:
+            logger.error(f"{e} - retrying with the next write")
+        LOAD_SECONDS.set(time.perf_counter() - start)
+
+    def _load_snapshot(self) -> int:
+        """Read the snapshot file and return the last log sequence it contains"""
+        if not self.path.exists():
+            return 0
+
+        try:
+            data = codec.loads(self.path.read_bytes())
+        except Exception as e:
+            # Keep the broken file around instead of overwriting it
+            corrupt = self.path.with_suffix(".json.corrupt")
+            logger.error(f"Error loading events: {e} - moved to {corrupt.name}")
+            ERRORS.labels("snapshot").inc()
+            os.replace(self.path, corrupt)
+            return 0
+
+        # Events from before sequence ids get them oldest first
+        self._next_seq = int(data.get("next_seq", 1))
+        for day in reversed(DAYS):
+            for event in reversed(data.get(day, [])):
+                if "seq" not in event:
+                    event["seq"] = self._next_seq
+                self._next_seq = max(self._next_seq, event["seq"] + 1)
+
+        self._data["today"] = DayEvents.from_dicts(data.get("today", []))
+        if data.get("date"):
+            self._date = date.fromisoformat(data["date"])
+        else:
+            # Snapshots from before date tracking: the newest event's date,
+            # or the day after yesterday's if today is empty
+            today_dates = [event["date"] for event in data.get("today", []) if event.get("date")]
+            yesterday_dates = [event["date"] for event in data.get("yesterday", []) if event.get("date")]
+            if today_dates:
+                self._date = date.fromisoformat(max(today_dates))
+            elif yesterday_dates:
+                self._date = date.fromisoformat(max(yesterday_dates)) + timedelta(days=1)
+
+        if self._date is not None:
+            yesterday = self._date - timedelta(days=1)
+            if data.get("yesterday"):
+                # Snapshots from before partitioning still carry yesterday
+                self._data["yesterday"] = DayEvents.from_dicts(data["yesterday"])
+                self._write_partition(yesterday, self._data["yesterday"])
+            else:
+                self._data["yesterday"] = self._read_partition(yesterday)
+        return int(data.get("log_seq", 0))
+
+    def _replay_log(self, after_seq: int) -> Tuple[int, bool]:
+        """Apply log records newer than the snapshot.
+
+        Returns the number of applied records and whether unreadable
+        records were skipped.
+        """
+        if not self.log_path.exists():
+            return 0, False
+
+        replayed = 0
+        torn = False
+        with open(self.log_path, "rb") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    # Written after a failed write to start on a fresh line
+                    continue
+                try:
+                    record = codec.loads(line)
+                except ValueError:
+                    # A torn write can only affect the tail of the log
+                    logger.warning(f"Ignoring unreadable log record at line {line_no}")
+                    ERRORS.labels("log").inc()
+                    torn = True
+                    continue
+                # Older than the snapshot, or written again after a failed write
+                if record.get("n", 0) <= self._log_seq:
+                    continue
+                self._apply(record)
+                self._log_seq = record["n"]
+                replayed += 1
+        return replayed, torn
+
+    def _open_log(self) -> None:
+        """Open the write-ahead log for appending"""
+        self._log = open(self.log_path, "ab")
+
+    def _queue(self, *jobs: Union[bytes, Callable[[], None]]) -> None:
+        """Hand writes to the writer task, which runs them in order"""
+        self._jobs.extend(jobs)
+        self._dirty.set()
+
+    def _append(self, *records: dict) -> None:
+        """Queue records for the log, compacting when due"""
+        lines = []
+        for record in records:
+            self._log_seq += 1
+            record["n"] = self._log_seq
+            lines.append(_encode(record))
+        self._queue(*lines)
+
+        self._log_records += len(records)
+        if self._log_records >= self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """Queue a snapshot of today, after which the log starts fresh"""
+        snapshot = codec.dumps(
+            {
+                "date": self._date.isoformat() if self._date else None,
+                "today": self._data["today"].to_dicts(),
+                "next_seq": self._next_seq,
+                "log_seq": self._log_seq,
+            }
+        )
+        self._queue(partial(self._write_snapshot, snapshot))
+        self._log_records = 0
+
+    def _write_snapshot(self, snapshot: bytes) -> bool:
+        """Replace the snapshot and truncate the log it supersedes"""
+        if not _save_file(self.path, snapshot, "snapshot"):
+            return False
+
+        # Records up to log_seq are now in the snapshot, so the log can go
+        if self._log is not None:
+            self._log.close()
+        with open(self.log_path, "wb"):
+            pass
+        self._unsynced = False
+        self._log_failed = False
+        if self._log is not None:
+            self._open_log()
+        return True
+
+    def _write(self, jobs: List[Union[bytes, Callable[[], None]]], fsync: bool) -> None:
+        """Run queued writes in order, joining consecutive log lines into one write.
+
+        Whole-file jobs return False when they fail. On the first failure
+        the jobs not done yet go back to the front of the queue, to be
+        retried with the next commit, and OSError is raised.
+        """
+        lines: List[bytes] = []
+        done = 0
+        for i, job in enumerate(jobs):
+            if isinstance(job, bytes):
+                lines.append(job)
+                continue
+            ok = self._write_log(lines, fsync)
+            if ok:
+                lines = []
+                done = i
+                try:
+                    ok = job() is not False
+                except Exception as e:
+                    logger.error(f"Error writing files: {e}")
+                    ok = False
+            if not ok:
+                break
+            done = i + 1
+        else:
+            if self._write_log(lines, fsync):
+                return
+        self._jobs[:0] = jobs[done:]
+        raise OSError(f"{len(jobs) - done} write(s) postponed")
+
+    def _write_log(self, lines: List[bytes], fsync: bool) -> bool:
+        """Append lines to the log, fsyncing everything not yet on disk if asked.
+
+        Returns False if the write failed. The log is then reopened before
+        the next write, which starts on a new line so that a torn record
+        can't swallow it.
+        """
+        if not lines and not (fsync and self._unsynced):
+            return True
+        start = time.perf_counter()
+        try:
+            if self._log_failed:
+                with contextlib.suppress(Exception):
+                    self._log.close()
+                self._open_log()
+                self._log.write(b"\n")
+                self._unsynced = True
+                self._log_failed = False
+            if lines:
+                data = b"".join(lines)
+                self._log.write(data)
+                self._log.flush()
+                self._unsynced = True
+                WRITE_BYTES.labels("log").observe(len(data))
+            if fsync and self._unsynced:
+                os.fsync(self._log.fileno())
+                self._unsynced = False
+        except Exception as e:
+            logger.error(f"Error writing event log: {e}")
+            ERRORS.labels("log").inc()
+            self._log_failed = True
+            return False
+        WRITE_SECONDS.labels("log").observe(time.perf_counter() - start)
+        return True
+
+    def start_writer(self) -> None:
+        """Start the task that commits queued writes in the background"""
+        self._writer = asyncio.get_running_loop().create_task(self._run_writer())
+
+    async def _run_writer(self) -> None:
+        """Group-commit queued writes from a worker thread until the store is closed"""
+        while True:
+            await self._dirty.wait()
+            if not self._urgent.is_set():
+                # Give concurrent requests a moment to join this commit
+                try:
+                    await asyncio.wait_for(self._urgent.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._dirty.clear()
+            self._urgent.clear()
+
+            jobs, self._jobs = self._jobs, []
+            waiters, self._waiters = self._waiters, []
+            error: Optional[Exception] = None
+            try:
+                await asyncio.to_thread(
+                    self._write, jobs, bool(waiters) or self.durability == "fsync"
+                )
+            except Exception as e:
+                # Already logged and counted; the rest stays queued
+                error = e
+            for waiter in waiters:
+                if not waiter.done():
+                    if error is None:
+                        waiter.set_result(None)
+                    else:
+                        waiter.set_exception(error)
+
+            # A failing disk must not hold up shutdown
+            if self._closing and (not self._jobs or error is not None):
+                return
+
+    async def commit(self) -> None:
+        """Wait until every change made so far is written and fsync'ed"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._dirty.set()
+        self._urgent.set()
+        await waiter
+
+    async def close(self) -> None:
+        """Fold the log into a final snapshot, drain the writer and close the log"""
+        if self._log is None:
+            return
+        self.compact()
+        self._closing = True
+        if self._writer is not None and not self._writer.done():
+            self._urgent.set()
+            await self._writer
+        else:
+            jobs, self._jobs = self._jobs, []
+            try:
+                self._write(jobs, fsync=True)
+            except OSError as e:
+                logger.error(f"{e} - lost on shutdown")
+        self._log.close()
+        self._log = None
+
+    def _partition_path(self, day_date: date) -> Path:
+        """Return the file a sealed day is stored in"""
+        return self.days_dir / f"{day_date.isoformat()}.json"
+
+    def _read_partition(self, day_date: date) -> DayEvents:
+        """Load a sealed day from disk (empty if there is none)"""
+        path = self._partition_path(day_date)
+        if not path.exists():
+            return DayEvents()
+        try:
+            return DayEvents.from_dicts(codec.loads(path.read_bytes()).get("events", []))
+        except Exception as e:
+            logger.error(f"Error loading {path.name}: {e}")
+            ERRORS.labels("day").inc()
+            return DayEvents()
+
+    def _write_partition(self, day_date: date, events: DayEvents) -> None:
+        """Queue an atomic write of a sealed day, removing the file if it is empty.
+
+        The day is kept in memory until the write has landed, so it is
+        never read back from its stale file.
+        """
+        data = None
+        if events:
+            data = codec.dumps({"date": day_date.isoformat(), "events": events.to_dicts()})
+        with self._pending_lock:
+            pending = self._pending.get(day_date)
+            self._pending[day_date] = [events, pending[1] + 1 if pending else 1]
+        self._partition_writes[day_date] = self._partition_writes.get(day_date, 0) + 1
+        if day_date in self._cold:
+            self._cold[day_date] = events
+        self._queue(partial(self._save_partition, day_date, data))
+
+    def _save_partition(self, day_date: date, data: Optional[bytes]) -> bool:
+        """Write a sealed day (runs on the writer thread); a failed write stays pending"""
+        if not _save_file(self._partition_path(day_date), data, "day"):
+            return False
+        with self._pending_lock:
+            pending = self._pending[day_date]
+            pending[1] -= 1
+            if not pending[1]:
+                del self._pending[day_date]
+        return True
+
+    def _resident(self, day_date: date) -> Optional[DayEvents]:
+        """Return a sealed day held in memory: one with a pending write, or a cached one"""
+        pending = self._pending.get(day_date)
+        if pending is not None:
+            return pending[0]
+        events = self._cold.get(day_date)
+        if events is not None:
+            self._cold.move_to_end(day_date)
+        return events
+
+    def _cache(self, day_date: date, events: DayEvents) -> None:
+        """Keep a day read from disk, evicting the least recently used one"""
+        self._cold[day_date] = events
+        if len(self._cold) > COLD_CACHE_SIZE:
+            self._cold.popitem(last=False)
+
+    def _prune(self, oldest: date) -> None:
+        """Delete sealed days older than oldest (runs on the writer thread)"""
+        removed = 0
+        for path in self.days_dir.glob("*.json"):
+            try:
+                day_date = date.fromisoformat(path.stem)
+            except ValueError:
+                continue
+            if day_date < oldest:
+                path.unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            logger.info(f"Cleaned up {removed} day(s) older than {self.retention_days} days")
+
+    def add_listener(self, listener: Callable[[str, dict], None]) -> None:
+        """Register a callback that is told about every insert, update, clear and rollover.
+
+        Inserts and clears of today and yesterday carry the day, those of
+        older dates only the date.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, kind: str, data: dict) -> None:
+        """Pass a change to all listeners"""
+        for listener in self._listeners:
+            listener(kind, data)
+
+    def _record_change(self, change: Union[dict, Record]) -> int:
+        """Give a change that adds no event the next sequence id and journal it"""
+        seq = self._next_seq
+        self._next_seq += 1
+        self._journal.append((seq, change))
+        if len(self._journal) > JOURNAL_SIZE:
+            self._journal_floor, _ = self._journal.popleft()
+        return seq
+
+    def _reset_journal(self) -> None:
+        """Forget the journal, so clients behind the next seq fetch the full feed"""
+        self._journal.clear()
+        self._journal_floor = self._next_seq
+        self._next_seq += 1
+
+    def _reindex(self) -> None:
+        """Rebuild the search index from every retained day.
+
+        Older days are read from disk on the event loop; this only runs on
+        loading, on a replica's restore and when the clock moves back.
+        """
+        self._index.clear()
+        if self._date is None:
+            return
+        for day_date in self.dates():
+            if day_date >= self.day_date("yesterday"):
+                events = self.partition(day_date)
+            else:
+                # Days with a pending write hold changes their files don't have yet
+                events = self._resident(day_date)
+                if events is None:
+                    events = self._read_partition(day_date)
+            for event in events.newest_first():
+                self._index.add(day_date, event)
+        if len(self._index):
+            logger.info(f"Indexed {len(self._index)} event(s) for search")
+
+    def state(self) -> dict:
+        """Return everything held in memory, for a replica to start from"""
+        with self._pending_lock:
+            # Days whose files are stale until their pending writes land
+            cold = {**self._cold, **{day_date: pending[0] for day_date, pending in self._pending.items()}}
+        return {
+            "date": self._date.isoformat() if self._date else None,
+            "next_seq": self._next_seq,
+            "versions": self._versions,
+            **{day: self._data[day].to_dicts() for day in DAYS},
+            "cold": {day_date.isoformat(): events.to_dicts() for day_date, events in cold.items()},
+            "journal_floor": self._journal_floor,
+            "journal": [
+                [seq, change if isinstance(change, dict) else {"event": change.to_dict()}]
+                for seq, change in self._journal
+            ],
+        }
+
+    def restore(self, state: dict) -> None:
+        """Replace everything held in memory with a state from another store"""
+        self._date = date.fromisoformat(state["date"]) if state["date"] else None
+        self._next_seq = state["next_seq"]
+        self._versions = dict(state["versions"])
+        self._data = {day: DayEvents.from_dicts(state[day]) for day in DAYS}
+        self._cold = OrderedDict(
+            (date.fromisoformat(day_date), DayEvents.from_dicts(events))
+            for day_date, events in state["cold"].items()
+        )
+        self._journal_floor = state["journal_floor"]
+        self._journal.clear()
+        for seq, change in state["journal"]:
+            if "event" in change:
+                # Updates refer to the stored event itself while it is kept
+                event = Record.from_dict(change["event"])
+                stored = self._data["today"].get(event.id) or self._data["yesterday"].get(event.id)
+                change = stored if stored is not None and stored.seq == event.seq else event
+            self._journal.append((seq, change))
+        self._reindex()
+
+    def _touch(self, *days: str) -> None:
+        """Bump the version of the given days after they changed"""
+        for day in days:
+            self._versions[day] += 1
+
+    def _apply(self, record: dict) -> None:
+        """Apply a log record to the in-memory feed"""
+        op = record.get("op")
+        if op == "add":
+            event = Record.from_dict(record["event"])
+            self._insert_dated(event)
+            self._next_seq = max(self._next_seq, event.seq + 1)
+        elif op == "clear":
+            self._clear(record["day"])
+        elif op == "update":
+            self._update("today", record["id"], record["changes"])
+
+    def _insert(self, event: Record) -> None:
+        """Insert an event at the top of today's feed, enforcing the cap"""
+        for evicted in self._data["today"].insert(event, self.max_events):
+            self._index.remove(self._date, evicted.seq)
+        self._index.add(self._date, event)
+        self._touch("today")
+
+    def _insert_dated(self, event: Record) -> Optional[str]:
+        """Insert an event into the day it is dated, which may be an earlier retained one.
+
+        Returns "today", "yesterday" or None for an older date. Earlier days
+        are written to their partition, like updates of yesterday; an event
+        the partition already holds (a replayed log record) is skipped.
+        """
+        day_date = self._date
+        if event.date and self._date is not None:
+            day_date = min(date.fromisoformat(event.date), self._date)
+        if day_date == self._date:
+            self._insert(event)
+            return "today"
+
+        day = "yesterday" if day_date == self.day_date("yesterday") else None
+        events = self._data[day] if day else self.partition(day_date)
+        if events.find(event.seq) is not None:
+            return day
+        for evicted in events.insert(event, self.max_events):
+            self._index.remove(day_date, evicted.seq)
+        self._index.add(day_date, event)
+        self._write_partition(day_date, events)
+        self._touch(day or "history")
+        return day
+
+    def _clear(self, day: str) -> None:
+        """Empty today or yesterday in memory (and on disk for yesterday)"""
+        self._data[day] = DayEvents()
+        if self._date is not None:
+            self._index.remove_date(self.day_date(day))
+            if day == "yesterday":
+                self._write_partition(self.day_date(day), self._data[day])
+        self._touch(day)
+
+    def _update(self, day: str, event_id: str, changes: dict) -> Optional[Record]:
+        """Change an event of today or yesterday in memory (and on disk for yesterday)"""
+        event = self._data[day].get(event_id)
+        if event is None:
+            return None
+        for key in UPDATABLE_FIELDS:
+            if key in changes:
+                setattr(event, key, changes[key])
+        if day == "yesterday":
+            self._write_partition(self.day_date(day), self._data[day])
+        self._touch(day)
+        return event
+
+    def ensure_current(self) -> bool:
+        """Cheap per-request check that only rolls over when the date differs"""
+        today = date.today()
+        if today == self._date:
+            return False
+        return self.rollover(today)
+
+    def rollover(self, today: date) -> bool:
+        """Seal the current day and start a new one.
+
+        Today's partition is written to ``days/`` and becomes yesterday if
+        the feed is exactly one day old. Partitions outside the retention
+        window are deleted. Returns True (and writes a snapshot) only if
+        something was changed.
+        """
+        if self._date is None or self._date > today:
+            # Unknown or future date (clock moved back): adopt the current one
+            self._date = today
+            self._reset_journal()
+            self._reindex()
+            self._touch(*DAYS, "history")
+            self.compact()
+            self._notify("rollover", {"date": today.isoformat()})
+            return True
+        if self._date == today:
+            return False
+
+        sealed_date, sealed = self._date, self._data["today"]
+        self._write_partition(sealed_date, sealed)
+        if self._date == today - timedelta(days=1):
+            logger.info(f"Date changed - moved {len(sealed)} events to yesterday")
+            self._data["yesterday"] = sealed
+            self._record_change({"op": "rollover", "date": today.isoformat()})
+        else:
+            # Yesterday comes from disk with old sequence ids, which a
+            # delta could not carry. Nothing is dated after the sealed day,
+            # so there is rarely a file, and at most one small read after
+            # a midnight the add-on missed.
+            yesterday = today - timedelta(days=1)
+            events = self._resident(yesterday)
+            self._data["yesterday"] = self._read_partition(yesterday) if events is None else events
+            self._reset_journal()
+        self._data["today"] = DayEvents()
+        self._date = today
+        # Days with pending writes (the sealed day among them) stay in memory
+        self._cold.clear()
+        self._partition_writes = {
+            day_date: writes for day_date, writes in self._partition_writes.items() if day_date >= self.oldest_date
+        }
+        self._index.trim(self.oldest_date, today)
+        self._touch(*DAYS, "history")
+
+        self._queue(partial(self._prune, self.oldest_date))
+        self.compact()
+        ROLLOVERS.inc()
+        self._notify("rollover", {"date": today.isoformat()})
+        return True
+
+    @property
+    def current_date(self) -> Optional[date]:
+        """The date the "today" slot currently represents"""
+        return self._date
+
+    @property
+    def oldest_date(self) -> date:
+        """The oldest date still inside the retention window"""
+        return self._date - timedelta(days=self.retention_days - 1)
+
+    def day_date(self, day: str) -> date:
+        """Return the date of today or yesterday"""
+        if day == "yesterday":
+            return self._date - timedelta(days=1)
+        return self._date
+
+    def version(self, day: str) -> int:
+        """Return a counter that changes whenever the day's events change.
+
+        "history" changes whenever any older partition does.
+        """
+        return self._versions[day]
+
+    def _on_disk(self, day_date: date) -> bool:
+        """Check whether a retained date has to be read from disk"""
+        return (
+            self._date is not None
+            and self.oldest_date <= day_date < self.day_date("yesterday")
+            and self._resident(day_date) is None
+        )
+
+    def partition(self, day_date: date) -> DayEvents:
+        """Return the events of any retained date, reading old days from disk.
+
+        The read blocks, so requests bring older days into memory with
+        load_partitions first.
+        """
+        for day in DAYS:
+            if day_date == self.day_date(day):
+                return self._data[day]
+        if day_date < self.oldest_date or day_date > self._date:
+            return DayEvents()
+
+        events = self._resident(day_date)
+        if events is None:
+            events = self._read_partition(day_date)
+            self._cache(day_date, events)
+        return events
+
+    async def load_partitions(self, dates: Iterable[date]) -> Dict[date, DayEvents]:
+        """Return the events of retained dates, reading older days off the event loop"""
+        loaded = {}
+        for day_date in dates:
+            while self._on_disk(day_date):
+                writes = self._partition_writes.get(day_date, 0)
+                events = await asyncio.to_thread(self._read_partition, day_date)
+                # A write queued meanwhile keeps the day in memory; one that
+                # already landed means this read may predate it
+                if self._on_disk(day_date) and self._partition_writes.get(day_date, 0) == writes:
+                    self._cache(day_date, events)
+            loaded[day_date] = self.partition(day_date)
+        return loaded
+
+    def dates(self, start: Optional[date] = None, end: Optional[date] = None) -> List[date]:
+        """Return the retained dates between start and end, newest first"""
+        start = max(start or self.oldest_date, self.oldest_date)
+        end = min(end or self._date, self._date)
+        return [end - timedelta(days=i) for i in range((end - start).days + 1)]
+
+    @property
+    def last_seq(self) -> int:
+        """The sequence id of the latest change to today or yesterday"""
+        return self._next_seq - 1
+
+    def changes_since(self, seq: int) -> Optional[Tuple[List[dict], Dict[str, List[Record]]]]:
+        """Return what changed after a sequence id, besides new events.
+
+        That is the tombstones of clears and rollovers, oldest first, and
+        per day the events still stored there that were updated (new
+        events are read with ``query(after=seq)``). Returns None if the
+        journal doesn't reach back that far, or seq is ahead of the store.
+        """
+        if seq < self._journal_floor or seq > self.last_seq:
+            return None
+        start = bisect_right(self._journal, seq, key=itemgetter(0))
+        tombstones = []
+        updated: Dict[str, Dict[int, Record]] = {day: {} for day in DAYS}
+        for change_seq, change in islice(self._journal, start, None):
+            if isinstance(change, dict):
+                tombstones.append({"seq": change_seq, **change})
+            elif change.seq <= seq:
+                for day in DAYS:
+                    if self._data[day].get(change.id) is change:
+                        updated[day][change.seq] = change
+        return tombstones, {
+            day: sorted(events.values(), key=_seq, reverse=True) for day, events in updated.items()
+        }
+
+    def count(self, day: str) -> int:
+        """Return the number of stored events for today or yesterday"""
+        return len(self._data[day])
+
+    def query(self, day: str, **filters) -> Tuple[int, List[Record]]:
+        """Filter and page a day's events through its indexes, see DayEvents.query"""
+        return self._data[day].query(**filters)
+
+    def get(self, event_id: str) -> Optional[Record]:
+        """Return the event of today or yesterday with a client-supplied id"""
+        for day in DAYS:
+            event = self._data[day].get(event_id)
+            if event is not None:
+                return event
+        return None
+
+    def add(self, event: Record) -> None:
+        """Insert an event into today's feed and log it"""
+        self.add_many([event])
+
+    def add_many(self, events: List[Record]) -> None:
+        """Insert several events in order and log them with one write.
+
+        Each event is given the next sequence id and goes to the retained
+        day it is dated (today if it has no date).
+        """
+        if not events:
+            return
+        days = []
+        for event in events:
+            event.seq = self._next_seq
+            self._next_seq += 1
+            days.append(self._insert_dated(event))
+        self._append(*({"op": "add", "event": event.to_dict()} for event in events))
+        for event, day in zip(events, days):
+            if day is None:
+                self._notify("insert", {"date": event.date, "event": event})
+            else:
+                self._notify("insert", {"day": day, "event": event, "count": len(self._data[day])})
+
+    def update(self, event_id: str, changes: dict) -> Optional[Record]:
+        """Change the image fields of an event of today or yesterday, found by its id.
+
+        Returns None if no stored event has that id.
+        """
+        changes = {key: changes[key] for key in UPDATABLE_FIELDS if key in changes}
+        for day in DAYS:
+            event = self._update(day, event_id, changes)
+            if event is not None:
+                break
+        else:
+            return None
+
+        self._record_change(event)
+        if day == "today":
+            self._append({"op": "update", "id": event_id, "changes": changes})
+        self._notify("update", {"day": day, "event": event})
+        return event
+
+    def clear(self, day: str) -> int:
+        """Remove all events of today or yesterday and return how many were removed"""
+        count = len(self._data[day])
+        if count:
+            self._clear(day)
+            self._record_change({"op": "clear", "date": self.day_date(day).isoformat()})
+            if day == "today":
+                self._append({"op": "clear", "day": day})
+            self._notify("clear", {"day": day, "date": self.day_date(day).isoformat()})
+        return count
+
+    def clear_date(self, day_date: date) -> int:
+        """Remove all events of any retained date and return how many were removed"""
+        for day in DAYS:
+            if day_date == self.day_date(day):
+                return self.clear(day)
+        count = len(self.partition(day_date))
+        if count:
+            # Serve the cleared day from memory until the write has landed
+            self._cold[day_date] = DayEvents()
+            self._write_partition(day_date, self._cold[day_date])
+            self._index.remove_date(day_date)
+            self._touch("history")
+            self._notify("clear", {"date": day_date.isoformat()})
+        return count
+
+    async def search(
+        self,
+        text: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        types: Optional[Iterable[str]] = None,
+        priorities: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        newest_first: bool = False,
+    ) -> Tuple[int, List[Tuple[float, Record]]]:
+        """Find the retained events matching every word of a query.
+
+        Returns the number of matches and a page of (score, event), best
+        match first or, with newest_first, by date and seq. Only the
+        events of the page are looked up, older days off the event loop.
+        """
+        matches = self._index.search(text, start, end, types, priorities)
+        key = itemgetter(1, 2) if newest_first else itemgetter(0, 1, 2)
+        if limit is None:
+            ranked = sorted(matches, key=key, reverse=True)
+        else:
+            ranked = heapq.nlargest(offset + limit, matches, key=key)
+        ranked = ranked[offset:]
+        partitions = await self.load_partitions(dict.fromkeys(day_date for _, day_date, _ in ranked))
+        page = []
+        for score, day_date, seq in ranked:
+            event = partitions[day_date].find(seq)
+            if event is not None:
+                page.append((score, event))
+        return len(matches), page